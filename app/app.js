@@ -329,6 +329,26 @@ async function loadInteractionData() {
   }
 }
 
+async function fetchSearchShard(file) {
+  const resp = await fetch(`data/search/${file}`);
+  const bytes = new Uint8Array(await resp.arrayBuffer());
+  // 有的静态服务器会带 Content-Encoding: gzip 由浏览器解压，按 gzip 魔数判断是否需要自行解压
+  if (bytes[0] === 0x1f && bytes[1] === 0x8b) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+    return new Response(stream).json();
+  }
+  return JSON.parse(new TextDecoder().decode(bytes));
+}
+
+function expandSearchShard(shard) {
+  const headers = shard.header_strings || [];
+  return (shard.items || []).map((entry) => {
+    const text = entry.search_text;
+    if (!text || typeof text === "string") return entry;
+    return { ...entry, search_text: (headers[text.p] || "") + (text.rest || "") };
+  });
+}
+
 async function loadSearchIndex() {
   try {
     let entries = [];
@@ -336,10 +356,10 @@ async function loadSearchIndex() {
     if (manifestResp.ok) {
       const manifest = await manifestResp.json();
       const shardPromises = (manifest.shards || []).map((shard) =>
-        fetch(`data/search/${shard.file}`).then((resp) => resp.json())
+        fetchSearchShard(shard.file)
       );
       const shards = await Promise.all(shardPromises);
-      entries = shards.flatMap((shard) => shard.items || []);
+      entries = shards.flatMap(expandSearchShard);
     } else {
       const fallbackResp = await fetch(SEARCH_FALLBACK_PATH);
       if (!fallbackResp.ok) throw new Error("search index missing");
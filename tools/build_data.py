@@ -4,44 +4,73 @@ import csv
 import json
 import os
 import re
+import shutil
 import sys
 import tempfile
 import zipfile
+from collections import deque
 from datetime import datetime, timezone
+from functools import lru_cache, partial
+from itertools import count, islice
 
 from build_insights_index import build_index
-from prepare_cursor_browse import build_conversation_files
-
-
-TOOL_JSON_KEYS = {
-    "search_query",
-    "response_length",
-    "path",
-    "args",
-    "tool_calls",
-    "tool",
-    "function",
-    "call",
-}
+from prepare_cursor_browse import (
+    build_conversation_files,
+    is_tool_call_block,
+    iter_batched_map,
+    iter_json_array,
+    json_dumps,
+    json_loads,
+    peek_json_start,
+    slugify,
+    write_index_md,
+)
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+CHATGPT_EXPORT_NAMES = frozenset({"conversations.json", "conversations.jsonl"})
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+MSG_OPEN = b"<!-- MSG role: "
+MSG_MID = b" -->\n### "
+MSG_BODY = b"\n\n"
+MSG_CLOSE = b"\n\n<!-- /MSG -->\n\n"
+ISO_TS_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}Z")
 
 
 def format_ts(value):
-    if not value:
+    if not value or not isinstance(value, (int, float, str)):
         return "unknown"
+    return format_ts_cached(value)
+
+
+@lru_cache(maxsize=65536)
+def format_ts_cached(value):
     if isinstance(value, (int, float)):
         try:
-            return datetime.fromtimestamp(value, tz=timezone.utc).strftime(
-                "%Y-%m-%d %H:%M:%SZ"
-            )
+            dt = datetime.fromtimestamp(value, tz=timezone.utc)
         except Exception:
             return "unknown"
+        # 固定格式手工拼接，比 strftime 快且不受 locale 影响
+        return "%04d-%02d-%02d %02d:%02d:%02dZ" % (
+            dt.year,
+            dt.month,
+            dt.day,
+            dt.hour,
+            dt.minute,
+            dt.second,
+        )
     if isinstance(value, str):
         text = value.strip()
         if not text:
             return "unknown"
         if text.endswith("Z") and "T" in text:
             return text.replace("T", " ").replace("+00:00", "Z")
-        if re.match(r"\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2}Z", text):
+        if ISO_TS_RE.match(text):
             return text
     return "unknown"
 
@@ -52,51 +81,45 @@ def normalize_content(content):
     if isinstance(content, str):
         return content
     if isinstance(content, list):
-        return "\n".join([normalize_content(item) for item in content if item])
-    return json.dumps(content, ensure_ascii=False)
-
-
-def is_tool_call_block(text):
-    if not text or not isinstance(text, str):
-        return False
-    stripped = text.strip()
-    if not stripped:
-        return False
-    payload = stripped
-    if stripped.startswith("```"):
-        lines = stripped.splitlines()
-        if not lines:
-            return False
-        fence = lines[0].strip()
-        if not fence.startswith("```"):
-            return False
-        lang = fence[3:].strip().lower()
-        if lang and lang != "unknown":
-            return False
-        if len(lines) < 2:
-            return False
-        if not lines[-1].strip().startswith("```"):
-            return False
-        payload = "\n".join(lines[1:-1]).strip()
-        if not payload:
-            return False
-    try:
-        obj = json.loads(payload)
-    except json.JSONDecodeError:
-        return False
-    if not isinstance(obj, dict):
-        return False
-    return any(key in obj for key in TOOL_JSON_KEYS)
+        # 绝大多数消息是纯字符串列表，无需逐项递归
+        if all(type(item) is str for item in content):
+            return "\n".join(filter(None, content))
+        return "\n".join(normalize_content(item) for item in content if item)
+    return json_dumps(content)
+
+
+def iter_jsonl(path):
+    # 按行迭代二进制文件：行切分在缓冲读取器里完成，超长的单行也只拼接一次
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.isspace():
+                yield json_loads(line)
 
 
 def iter_generic_conversations(path):
     if path.endswith(".jsonl"):
-        with open(path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                yield json.loads(line)
+        yield from iter_jsonl(path)
+        return
+
+    # 逐条流式解析，避免把整个导出一次性载入内存
+    start = peek_json_start(path)
+    streamed = 0
+    if start in (b"[", b"{") and ijson is not None:
+        prefix = "item" if start == b"[" else "conversations.item"
+        try:
+            with open(path, "rb") as f:
+                for item in ijson.items(f, prefix, use_float=True):
+                    streamed += 1
+                    yield item
+        except ijson.JSONError:
+            # ijson 不接受超出 64 位的整数和 NaN/Infinity，这类文件改用下面的 json.load
+            # 重新读取，并跳过已经产出的条目
+            pass
+        else:
+            if streamed or start == b"[":
+                return
+    elif start == b"[":
+        yield from iter_json_array(path)
         return
 
     with open(path, "r", encoding="utf-8") as f:
@@ -105,118 +128,149 @@ def iter_generic_conversations(path):
         data = data["conversations"]
     if not isinstance(data, list):
         raise ValueError("Generic export must be a list of conversations.")
-    for item in data:
-        yield item
+    yield from islice(data, streamed, None)
 
 
-def build_generic_conversation_files(input_path, out_dir):
+def write_generic_conversation(total, conv, conv_dir):
+    title = conv.get("title") or "Untitled"
+    conv_id = conv.get("id") or conv.get("conversation_id") or ""
+    created = format_ts(
+        conv.get("created_utc")
+        or conv.get("created_at")
+        or conv.get("create_time")
+    )
+    updated = format_ts(
+        conv.get("updated_utc")
+        or conv.get("updated_at")
+        or conv.get("update_time")
+    )
+
+    messages = conv.get("messages") or []
+    rendered = []
+    for msg in messages:
+        role = (msg.get("role") or "unknown").strip()
+        body = normalize_content(msg.get("content") or msg.get("text")).strip()
+        if not body or is_tool_call_block(body):
+            continue
+        timestamp = format_ts(msg.get("created_utc") or msg.get("created_at"))
+        role_label = role
+        if timestamp != "unknown":
+            role_label = f"{role} ({timestamp})"
+        rendered.append((role_label, body))
+
+    date_prefix = "unknown"
+    if created != "unknown":
+        date_prefix = created.split(" ")[0].replace("-", "")
+
+    safe_title = slugify(title)
+    suffix = conv_id.split("-")[-1][:8] if conv_id else f"{total:04d}"
+    filename = f"{total:04d}_{date_prefix}_{safe_title}_{suffix}.md"
+    rel_path = os.path.join("conversations", filename)
+    out_path = os.path.join(conv_dir, filename)
+
+    with open(out_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        id_line = f"- id: {conv_id}\n" if conv_id else ""
+        parts = [
+            (
+                f"# {title}\n\n{id_line}"
+                f"- created_utc: {created}\n"
+                f"- updated_utc: {updated}\n"
+                f"- messages: {len(rendered)}\n"
+                "\n---\n\n"
+            ).encode("utf-8")
+        ]
+        for role_label, body in rendered:
+            label = role_label.encode("utf-8")
+            parts += (
+                MSG_OPEN,
+                label,
+                MSG_MID,
+                label,
+                MSG_BODY,
+                body.encode("utf-8"),
+                MSG_CLOSE,
+            )
+        f.write(b"".join(parts))
+
+    return (total, title, created, updated, len(rendered), rel_path, conv_id)
+
+
+def iter_written_generic_conversations(conversations, conv_dir, workers=1):
+    task = partial(write_generic_conversation, conv_dir=conv_dir)
+    return iter_batched_map(task, count(1), conversations, workers=workers)
+
+
+def build_generic_conversation_files(
+    input_path, out_dir, workers=1, emit_index_md=True
+):
     conv_dir = os.path.join(out_dir, "conversations")
     os.makedirs(conv_dir, exist_ok=True)
 
     index_md_path = os.path.join(out_dir, "index.md")
     index_csv_path = os.path.join(out_dir, "index.csv")
 
-    total = 0
-    with open(index_md_path, "w", encoding="utf-8") as index_md, open(
-        index_csv_path, "w", encoding="utf-8", newline=""
+    rows = list(
+        iter_written_generic_conversations(
+            iter_generic_conversations(input_path), conv_dir, workers=workers
+        )
+    )
+    with open(
+        index_csv_path,
+        "w",
+        encoding="utf-8",
+        newline="",
+        buffering=WRITE_BUFFER_SIZE,
     ) as index_csv:
         writer = csv.writer(index_csv)
         writer.writerow(
             ["index", "title", "created_utc", "updated_utc", "messages", "file", "id"]
         )
+        writer.writerows(rows)
 
-        index_md.write("# Conversations Index\n\n")
-        now = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
-        index_md.write(f"Generated: {now}\n\n")
-        index_md.write(
-            "| # | Title | Created (UTC) | Updated (UTC) | Messages | File |\n"
-        )
-        index_md.write("|---|---|---|---|---|---|\n")
-
-        for conv in iter_generic_conversations(input_path):
-            total += 1
-            title = conv.get("title") or "Untitled"
-            conv_id = conv.get("id") or conv.get("conversation_id") or ""
-            created = format_ts(
-                conv.get("created_utc")
-                or conv.get("created_at")
-                or conv.get("create_time")
-            )
-            updated = format_ts(
-                conv.get("updated_utc")
-                or conv.get("updated_at")
-                or conv.get("update_time")
-            )
+    if emit_index_md:
+        write_index_md(index_md_path, rows)
+    return len(rows)
 
-            messages = conv.get("messages") or []
-            rendered = []
-            for msg in messages:
-                role = (msg.get("role") or "unknown").strip()
-                body = normalize_content(msg.get("content") or msg.get("text"))
-                if is_tool_call_block(body):
-                    continue
-                timestamp = format_ts(msg.get("created_utc") or msg.get("created_at"))
-                role_label = role
-                if timestamp != "unknown":
-                    role_label = f"{role} ({timestamp})"
-                if body.strip():
-                    rendered.append((role_label, body.strip()))
-
-            date_prefix = "unknown"
-            if created != "unknown":
-                date_prefix = created.split(" ")[0].replace("-", "")
-
-            safe_title = re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")
-            safe_title = safe_title or "conv"
-            suffix = conv_id.split("-")[-1][:8] if conv_id else f"{total:04d}"
-            filename = f"{total:04d}_{date_prefix}_{safe_title}_{suffix}.md"
-            rel_path = os.path.join("conversations", filename)
-            out_path = os.path.join(conv_dir, filename)
-
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(f"# {title}\n\n")
-                if conv_id:
-                    f.write(f"- id: {conv_id}\n")
-                f.write(f"- created_utc: {created}\n")
-                f.write(f"- updated_utc: {updated}\n")
-                f.write(f"- messages: {len(rendered)}\n")
-                f.write("\n---\n\n")
-                for role_label, body in rendered:
-                    f.write(f"<!-- MSG role: {role_label} -->\n")
-                    f.write(f"### {role_label}\n\n")
-                    f.write(f"{body}\n\n")
-                    f.write("<!-- /MSG -->\n\n")
-
-            index_md.write(
-                f"| {total} | {title} | {created} | {updated} | {len(rendered)} | {rel_path} |\n"
-            )
-            writer.writerow(
-                [total, title, created, updated, len(rendered), rel_path, conv_id]
-            )
 
-    return total
+def pick_largest(candidates):
+    if not candidates:
+        return None
+    return min(candidates, key=lambda item: (-item[1], item[0]))[0]
 
 
-def pick_largest(paths):
-    if not paths:
-        return None
-    return sorted(paths, key=lambda p: (-os.path.getsize(p), p))[0]
+def find_export_files(root_dir, match):
+    # 用 scandir 逐层遍历收集 (路径, 大小)，不为每个目录构建 os.walk 的文件名列表；
+    # 仍收集整棵目录树，由 pick_largest 选出最大的文件
+    candidates = []
+    pending = deque([root_dir])
+    while pending:
+        current = pending.popleft()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file() and match(entry.name):
+                        try:
+                            size = entry.stat().st_size
+                        except OSError:
+                            continue
+                        candidates.append((entry.path, size))
+        except OSError:
+            continue
+    return candidates
 
 
 def resolve_input_path(input_path, source):
     if os.path.isdir(input_path):
-        candidates = []
         if source == "chatgpt":
-            names = {"conversations.json", "conversations.jsonl"}
-            for root, _, files in os.walk(input_path):
-                for name in files:
-                    if name in names:
-                        candidates.append(os.path.join(root, name))
+            candidates = find_export_files(
+                input_path, CHATGPT_EXPORT_NAMES.__contains__
+            )
         else:
-            for root, _, files in os.walk(input_path):
-                for name in files:
-                    if name.lower().endswith((".json", ".jsonl")):
-                        candidates.append(os.path.join(root, name))
+            candidates = find_export_files(
+                input_path, lambda name: name.lower().endswith((".json", ".jsonl"))
+            )
         picked = pick_largest(candidates)
         if picked:
             return picked
@@ -228,25 +282,28 @@ def resolve_input_path(input_path, source):
     temp_dir = tempfile.TemporaryDirectory()
     zip_path = input_path
     with zipfile.ZipFile(zip_path, "r") as zf:
-        members = [info for info in zf.infolist() if not info.is_dir()]
-        if source == "chatgpt":
-            candidates = [
-                info
-                for info in members
-                if os.path.basename(info.filename) in {"conversations.json", "conversations.jsonl"}
-            ]
-        else:
-            candidates = [
-                info
-                for info in members
-                if info.filename.lower().endswith((".json", ".jsonl"))
-            ]
+        candidates = []
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if source == "chatgpt":
+                if os.path.basename(info.filename) in CHATGPT_EXPORT_NAMES:
+                    candidates.append(info)
+            elif info.filename.lower().endswith((".json", ".jsonl")):
+                candidates.append(info)
         if not candidates:
             temp_dir.cleanup()
             raise FileNotFoundError(f"No export JSON found in zip: {zip_path}")
-        candidates.sort(key=lambda info: (-info.file_size, info.filename))
-        target = candidates[0]
-        extracted = zf.extract(target, temp_dir.name)
+        target = min(candidates, key=lambda info: (-info.file_size, info.filename))
+        extracted = os.path.join(temp_dir.name, os.path.basename(target.filename))
+        try:
+            with zf.open(target, "r") as src, open(
+                extracted, "wb", buffering=WRITE_BUFFER_SIZE
+            ) as dst:
+                shutil.copyfileobj(src, dst, length=WRITE_BUFFER_SIZE)
+        except BaseException:
+            temp_dir.cleanup()
+            raise
     return extracted, temp_dir
 
 
@@ -292,6 +349,12 @@ def main():
         default=300,
         help="Entries per search shard",
     )
+    parser.add_argument(
+        "--search-gzip",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Gzip search index shards (the app decompresses them in the browser)",
+    )
     parser.add_argument(
         "--include-search-text",
         action="store_true",
@@ -308,6 +371,12 @@ def main():
         default=240,
         help="Max characters for snippet",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for large exports (1 disables multiprocessing)",
+    )
     parser.add_argument(
         "--keep-hidden",
         action="store_true",
@@ -328,6 +397,17 @@ def main():
         action="store_true",
         help="Include all nodes in the conversation tree (ChatGPT only)",
     )
+    parser.add_argument(
+        "--emit-index-md",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Write the human-readable index.md (not read by the app)",
+    )
+    parser.add_argument(
+        "--vocab-cache-dir",
+        default=None,
+        help="Cache the bootstrapped Chinese vocabulary here to skip rebuilding on reruns",
+    )
     args = parser.parse_args()
 
     os.makedirs(args.out_dir, exist_ok=True)
@@ -351,9 +431,16 @@ def main():
                 keep_system=args.keep_system,
                 keep_metadata=args.keep_metadata,
                 include_all_nodes=args.include_all_nodes,
+                emit_index_md=args.emit_index_md,
+                workers=args.workers,
             )
         else:
-            total = build_generic_conversation_files(input_path, args.out_dir)
+            total = build_generic_conversation_files(
+                input_path,
+                args.out_dir,
+                workers=args.workers,
+                emit_index_md=args.emit_index_md,
+            )
     finally:
         if temp_dir is not None:
             temp_dir.cleanup()
@@ -377,6 +464,9 @@ def main():
         search_shard_size=args.search_shard_size,
         include_search_text=args.include_search_text,
         interaction_out=interaction_out,
+        workers=args.workers,
+        vocab_cache_dir=args.vocab_cache_dir,
+        search_gzip=args.search_gzip,
     )
     print(f"Built {total} conversations into {args.out_dir}")
 
@@ -1,285 +1,317 @@
 #!/usr/bin/env python3
 import argparse
 import csv
+import gzip
+import hashlib
+import heapq
 import json
 import os
 import math
+import pickle
 import re
+import tempfile
 from collections import Counter
 from datetime import datetime, timezone
+from functools import lru_cache, partial
+
+from prepare_cursor_browse import is_tool_call_block, iter_batched_map, json_loads
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+EN_STOPWORDS = frozenset(
+    {
+        "a",
+        "an",
+        "and",
+        "are",
+        "as",
+        "at",
+        "be",
+        "but",
+        "by",
+        "for",
+        "from",
+        "has",
+        "have",
+        "if",
+        "in",
+        "into",
+        "is",
+        "it",
+        "its",
+        "of",
+        "on",
+        "or",
+        "that",
+        "the",
+        "their",
+        "to",
+        "was",
+        "we",
+        "were",
+        "with",
+        "you",
+        "your",
+        "i",
+        "me",
+        "my",
+        "our",
+        "they",
+        "them",
+        "this",
+        "these",
+        "those",
+        "not",
+        "no",
+        "yes",
+        "can",
+        "could",
+        "should",
+        "would",
+        "will",
+        "just",
+        "also",
+        "about",
+        "how",
+        "what",
+        "why",
+        "when",
+        "where",
+        "which",
+        "who",
+        "whom",
+        "more",
+        "most",
+        "less",
+        "least",
+        "like",
+        "may",
+        "time",
+        "information",
+        "value",
+        "one",
+        "two",
+        "three",
+        "four",
+        "five",
+        "six",
+        "seven",
+        "eight",
+        "nine",
+        "ten",
+        "first",
+        "second",
+        "third",
+        "new",
+        "please",
+        "thanks",
+        "thank",
+        "using",
+        "used",
+        "useful",
+        "make",
+        "made",
+        "get",
+        "got",
+        "here",
+        "key",
+        "keys",
+        "provide",
+        "provided",
+        "provides",
+        "out",
+        "app",
+    }
+)
 
-
-EN_STOPWORDS = {
-    "a",
-    "an",
-    "and",
-    "are",
-    "as",
-    "at",
-    "be",
-    "but",
-    "by",
-    "for",
-    "from",
-    "has",
-    "have",
-    "if",
-    "in",
-    "into",
-    "is",
-    "it",
-    "its",
-    "of",
-    "on",
-    "or",
-    "that",
-    "the",
-    "their",
-    "to",
-    "was",
-    "we",
-    "were",
-    "with",
-    "you",
-    "your",
-    "i",
-    "me",
-    "my",
-    "our",
-    "they",
-    "them",
-    "this",
-    "these",
-    "those",
-    "not",
-    "no",
-    "yes",
-    "can",
-    "could",
-    "should",
-    "would",
-    "will",
-    "just",
-    "also",
-    "about",
-    "how",
-    "what",
-    "why",
-    "when",
-    "where",
-    "which",
-    "who",
-    "whom",
-    "more",
-    "most",
-    "less",
-    "least",
-    "like",
-    "may",
-    "time",
-    "information",
-    "value",
-    "one",
-    "two",
-    "three",
-    "four",
-    "five",
-    "six",
-    "seven",
-    "eight",
-    "nine",
-    "ten",
-    "first",
-    "second",
-    "third",
-    "new",
-    "please",
-    "thanks",
-    "thank",
-    "using",
-    "used",
-    "useful",
-    "make",
-    "made",
-    "get",
-    "got",
-    "here",
-    "key",
-    "keys",
-    "provide",
-    "provided",
-    "provides",
-    "out",
-    "app",
-}
-
-ZH_STOPWORDS = {
-    "的",
-    "了",
-    "是",
-    "我",
-    "你",
-    "他",
-    "她",
-    "它",
-    "我们",
-    "你们",
-    "他们",
-    "她们",
-    "它们",
-    "在",
-    "有",
-    "和",
-    "与",
-    "或",
-    "以及",
-    "并",
-    "但",
-    "而",
-    "就",
-    "也",
-    "还",
-    "很",
-    "非常",
-    "一个",
-    "这个",
-    "那个",
-    "这些",
-    "那些",
-    "如果",
-    "因为",
-    "所以",
-    "为什么",
-    "如何",
-    "什么",
-    "怎么",
-    "什么样",
-    "例如",
-    "比如",
-    "问题",
-    "分钟",
-    "小时",
-    "时间",
-    "以下",
-    "是什么",
-    "信息",
-    "好的",
-    "因此",
-    "同时",
-    "一下",
-    "一些",
-    "一个人",
-    "这种",
-    "那种",
-    "还有",
-    "以及",
-    "这里",
-    "那里",
-    "就是",
-    "不会",
-    "可以",
-    "需要",
-    "应该",
-    "可能",
-    "现在",
-    "之前",
-    "之后",
-    "因为",
-    "所以",
-    "然后",
-    "这样",
-    "那样",
-}
+ZH_STOPWORDS = frozenset(
+    {
+        "的",
+        "了",
+        "是",
+        "我",
+        "你",
+        "他",
+        "她",
+        "它",
+        "我们",
+        "你们",
+        "他们",
+        "她们",
+        "它们",
+        "在",
+        "有",
+        "和",
+        "与",
+        "或",
+        "以及",
+        "并",
+        "但",
+        "而",
+        "就",
+        "也",
+        "还",
+        "很",
+        "非常",
+        "一个",
+        "这个",
+        "那个",
+        "这些",
+        "那些",
+        "如果",
+        "因为",
+        "所以",
+        "为什么",
+        "如何",
+        "什么",
+        "怎么",
+        "什么样",
+        "例如",
+        "比如",
+        "问题",
+        "分钟",
+        "小时",
+        "时间",
+        "以下",
+        "是什么",
+        "信息",
+        "好的",
+        "因此",
+        "同时",
+        "一下",
+        "一些",
+        "一个人",
+        "这种",
+        "那种",
+        "还有",
+        "以及",
+        "这里",
+        "那里",
+        "就是",
+        "不会",
+        "可以",
+        "需要",
+        "应该",
+        "可能",
+        "现在",
+        "之前",
+        "之后",
+        "因为",
+        "所以",
+        "然后",
+        "这样",
+        "那样",
+    }
+)
 
 EN_RE = re.compile(r"[A-Za-z][A-Za-z0-9_]{1,}")
 ZH_RE = re.compile(r"[\u4e00-\u9fff]{2,}")
+ZH_CHAR_RE = re.compile(r"[\u4e00-\u9fff]")
 LIST_PREFIX_RE = re.compile(r"^\s*(?:[-*•]|\d+[\.、])\s*")
+LIST_PREFIX_CHARS = "-*•"
+# 对 lower() 后的文本匹配：不带 IGNORECASE 时 sre 才能按首字符快速跳过
 HIGHLIGHT_RE = re.compile(
-    r"(结论|总结|要点|建议|策略|风险|行动|下一步|计划|目标|决定|复盘|洞察|insight|summary|conclusion|recommend|next step|action|risk|decision)",
-    re.IGNORECASE,
+    r"(?:结论|总结|要点|建议|策略|风险|行动|下一步|计划|目标|决定|复盘|洞察|insight|summary|conclusion|recommend|next step|action|risk|decision)"
 )
-QUESTION_RE = re.compile(r"[?？]$")
+QUESTION_MARKS = ("?", "？")
+WORD_RE = re.compile(r"[A-Za-z0-9']+")
+DIGIT_RE = re.compile(r"\d")
+PLUS_NUMBER_RE = re.compile(r"\+\d+")
+MSG_START_MARK = "<!-- MSG role: "
+MSG_END_MARK = "\n<!-- /MSG -->"
+FRONTMATTER_RE = re.compile(r"^[^\S\n]*---[^\S\n]*$", re.MULTILINE)
+HEADING_BLOCK_RE = re.compile(r"^### (.+?)\n\n([\s\S]*?)(?=\n### |\Z)", re.MULTILINE)
 CITE_RE = re.compile(r".*?")
 SHORT_ALLOW = {"ai", "ml", "gpt"}
-NOISE_TERMS = {
-    "null",
-    "text",
-    "file",
-    "content",
-    "content_type",
-    "expiry_datetime",
-    "asset_pointer",
-    "metadata",
-    "direction",
-    "decoding_id",
-    "audio",
-    "video",
-    "tool_audio_direction",
-    "search_query",
-    "response_length",
-    "textdoc_id",
-    "loaded",
-    "turn",
-    "cite",
-    "navlist",
-    "news",
-    "com",
-    "www",
-    "nan",
-    "image",
-    "user",
-    "team",
-    "group",
-    "all",
-    "only",
-    "use",
-}
-
-TOOL_JSON_KEYS = {
-    "search_query",
-    "response_length",
-    "path",
-    "args",
-    "tool_calls",
-    "tool",
-    "function",
-    "call",
-}
+NOISE_TERMS = frozenset(
+    {
+        "null",
+        "text",
+        "file",
+        "content",
+        "content_type",
+        "expiry_datetime",
+        "asset_pointer",
+        "metadata",
+        "direction",
+        "decoding_id",
+        "audio",
+        "video",
+        "tool_audio_direction",
+        "search_query",
+        "response_length",
+        "textdoc_id",
+        "loaded",
+        "turn",
+        "cite",
+        "navlist",
+        "news",
+        "com",
+        "www",
+        "nan",
+        "image",
+        "user",
+        "team",
+        "group",
+        "all",
+        "only",
+        "use",
+    }
+)
 
 MAX_TEXT_CHARS_FOR_TERMS = 12000
+TOP_TERMS_LIMIT = 40
+SEARCH_SHARD_FORMAT = "v2"
+SEARCH_PREFIX_CHARS = 200
+SEARCH_GZIP_LEVEL = 6
 TURN_TOKEN_RE = re.compile(
     r"^turn\d+(?:search|news|view|file|calc|code|media)\d+$", re.IGNORECASE
 )
 SHORT_ID_RE = re.compile(r"^[a-z]{1,2}\d{1,4}$", re.IGNORECASE)
 MIXED_ID_RE = re.compile(r"^[a-z]{1,3}\d{3,}$", re.IGNORECASE)
+# 小写开头、后面出现大写（仅用于 ASCII 词）：camelCase 标识符
+CAMEL_CASE_RE = re.compile(r"[a-z][^A-Z]*[A-Z]")
+IDENTIFIER_SUFFIXES = (
+    "Service",
+    "Panel",
+    "Dashboard",
+    "Interface",
+    "Provider",
+    "Controller",
+    "Manager",
+)
+# 以下启发式正则不带 IGNORECASE，且用非捕获分组：这样 sre 能提取各分支首字符做快速跳过，
+# 比逐位置尝试所有分支快数倍。含英文分支的在调用处先对文本做 lower()。
 REQUEST_RE = re.compile(
-    r"(请|帮我|帮忙|如何|怎么|为什么|能否|可否|请问|怎么做|how|what|why|can you|could you)",
-    re.IGNORECASE,
+    r"(?:请|帮我|帮忙|如何|怎么|为什么|能否|可否|请问|怎么做|how|what|why|can you|could you)"
 )
 CONTEXT_RE = re.compile(
-    r"(背景|情况|我现在|我目前|我在|我是|我的|目标|需求|现状|因为|场景|计划|打算)",
-    re.IGNORECASE,
+    r"(?:背景|情况|我现在|我目前|我在|我是|我的|目标|需求|现状|因为|场景|计划|打算)"
 )
 CONSTRAINT_RE = re.compile(
-    r"(预算|限制|必须|不要|不想|至少|最多|以内|以上|不超过|不高于|不低于|prefer|limit|budget|must|only)",
-    re.IGNORECASE,
+    r"(?:预算|限制|必须|不要|不想|至少|最多|以内|以上|不超过|不高于|不低于|prefer|limit|budget|must|only)"
 )
 UNIT_RE = re.compile(
-    r"\d+\s?(元|美元|￥|¥|%|小时|分钟|天|周|月|年|km|公里|m|mb|gb|k|w|万|usd|rmb|dollar|day|hour|min)",
-    re.IGNORECASE,
+    r"\d+\s?(?:元|美元|￥|¥|%|小时|分钟|天|周|月|年|km|公里|m|mb|gb|k|w|万|usd|rmb|dollar|day|hour|min)"
 )
 STRUCTURE_RE = re.compile(r"^\s*(?:[-*•]|\d+[\\.、)])", re.MULTILINE)
 FEEDBACK_RE = re.compile(
-    r"(不对|错误|更正|调整|修改|改成|再|继续|太长|太短|不够|不太|不满意|优化|精简|补充|不是|改一下)",
-    re.IGNORECASE,
+    r"(?:不对|错误|更正|调整|修改|改成|再|继续|太长|太短|不够|不太|不满意|优化|精简|补充|不是|改一下)"
 )
 BOUNDARY_RE = re.compile(
-    r"(无法|不能|不支持|不便|不会|我不能|我无法|无法访问|无法浏览|没有实时|不具备|无法提供|as an ai|i can't|i cannot|i don't have access|i do not have access)",
-    re.IGNORECASE,
+    r"(?:无法|不能|不支持|不便|不会|我不能|我无法|无法访问|无法浏览|没有实时|不具备|无法提供|as an ai|i can't|i cannot|i don't have access|i do not have access)"
 )
 CLARIFY_RE = re.compile(
-    r"(请提供|需要更多|能否提供|请补充|还需要|更多信息|具体一点|进一步说明)",
-    re.IGNORECASE,
+    r"(?:请提供|需要更多|能否提供|请补充|还需要|更多信息|具体一点|进一步说明)"
 )
 
 # 这些词可以用于“主题命中”，但不应当作为关键词/主题标签直接展示（太像代码/文件噪声）。
@@ -327,6 +359,10 @@ KEYWORD_BLACKLIST = {
     "prettier",
 }
 
+# 所有停用/噪声词表都是小写形式，合并成一个集合后每个词只需查一次
+DROP_TERMS = frozenset(EN_STOPWORDS | NOISE_TERMS | ZH_STOPWORDS)
+KEYWORD_DROP_TERMS = DROP_TERMS | KEYWORD_BLACKLIST
+
 # 显示友好的别名/归一（会影响主题聚合与关键词展示）
 TERM_ALIASES = {
     # AI / 模型
@@ -617,6 +653,12 @@ TOPIC_RULES = [
     ),
 ]
 
+# 触发词（lower）-> 命中的 TOPIC_RULES 下标
+TOPIC_TRIGGERS = {}
+for _rule_idx, (_, _triggers) in enumerate(TOPIC_RULES):
+    for _trig in _triggers:
+        TOPIC_TRIGGERS.setdefault(_trig.lower(), []).append(_rule_idx)
+
 DOMAIN_ZH_TERMS = {
     # 投资理财核心词，确保能被中文分词命中
     "投资",
@@ -673,39 +715,113 @@ FILE_TOKEN_RE = re.compile(
 )
 
 
+if orjson is not None:
+    def json_dumps_bytes(value):
+        return orjson.dumps(value, option=orjson.OPT_APPEND_NEWLINE)
+
+    def json_dumps_indented(value):
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2)
+
+else:
+    def json_dumps_bytes(value):
+        # 与 orjson 的紧凑输出保持一致，保证有无 orjson 生成的分片相同
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        return (text + "\n").encode("utf-8")
+
+    def json_dumps_indented(value):
+        return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+
+
 def parse_datetime(value):
     if not value or value == "unknown":
         return None
     try:
+        # 常见的规范格式 "YYYY-MM-DD HH:MM:SSZ" 直接按位切片，省掉 strptime 的格式解析
+        if (
+            len(value) == 20
+            and value[4] == value[7] == "-"
+            and value[10] == " "
+            and value[13] == value[16] == ":"
+            and value[19] == "Z"
+        ):
+            digits = value[0:4] + value[5:7] + value[8:10] + value[11:13] + value[14:16] + value[17:19]
+            if digits.isascii() and digits.isdigit():
+                return datetime(
+                    int(value[0:4]),
+                    int(value[5:7]),
+                    int(value[8:10]),
+                    int(value[11:13]),
+                    int(value[14:16]),
+                    int(value[17:19]),
+                    tzinfo=timezone.utc,
+                )
         return datetime.strptime(value, "%Y-%m-%d %H:%M:%SZ").replace(tzinfo=timezone.utc)
     except ValueError:
         return None
 
 
+def read_text(path):
+    # 整块读取后一次解码，换行处理与文本模式读取一致
+    with open(path, "rb") as f:
+        text = f.read().decode("utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def iter_msg_blocks(body, pos=0):
+    """用 str.find 线性切分 `<!-- MSG role: x -->` … `<!-- /MSG -->` 块，产出 (role, content)。
+
+    等价于正则
+    `<!-- MSG role: (.+?) -->\\n(?:### .+?\\n\\n)?([\\s\\S]*?)\\n<!-- /MSG -->`；pos 为起始扫描位置。
+    """
+    find = body.find
+    while True:
+        start = find(MSG_START_MARK, pos)
+        if start < 0:
+            return
+        role_start = start + len(MSG_START_MARK)
+        # role 不能跨行，且必须以 " -->" 结尾并至少有一个字符
+        nl = find("\n", role_start)
+        if nl < 0:
+            return
+        if nl - 4 <= role_start or body[nl - 4 : nl] != " -->":
+            pos = start + 1
+            continue
+        role = body[role_start : nl - 4]
+        content_start = nl + 1
+        end = -1
+        # 可选的 "### 标题\n\n"；其后找不到结束标记时退回不跳过标题
+        if body.startswith("### ", content_start):
+            heading_end = find("\n", content_start + 4)
+            if heading_end > content_start + 4 and body.startswith("\n", heading_end + 1):
+                end = find(MSG_END_MARK, heading_end + 2)
+                if end >= 0:
+                    content_start = heading_end + 2
+        if end < 0:
+            end = find(MSG_END_MARK, content_start)
+            if end < 0:
+                return
+        yield role, body[content_start:end]
+        pos = end + len(MSG_END_MARK)
+
+
 def parse_messages(md_text):
     text = md_text.replace("\r\n", "\n")
-    lines = text.split("\n")
-    start_idx = 0
-    for idx, line in enumerate(lines):
-        if line.strip() == "---":
-            start_idx = idx + 1
-            break
-    body = "\n".join(lines[start_idx:])
+    # 正文从第一条 "---" 分隔行之后开始（没有分隔行则为全文）；只记偏移，不复制正文
+    match = FRONTMATTER_RE.search(text)
+    start = match.end() + 1 if match else 0
     messages = []
-    if "<!-- MSG role:" in body:
-        pattern = re.compile(
-            r"<!-- MSG role: (.+?) -->\n(?:### .+?\n\n)?([\s\S]*?)\n<!-- /MSG -->",
-            re.MULTILINE,
-        )
-        for match in pattern.finditer(body):
-            role = match.group(1).strip()
-            content = match.group(2).strip()
+    if text.find("<!-- MSG role:", start) >= 0:
+        for role, content in iter_msg_blocks(text, start):
+            role = role.strip()
+            content = content.strip()
             if content:
                 messages.append({"role": role, "body": content})
         return messages
 
-    pattern = re.compile(r"^### (.+?)\n\n([\s\S]*?)(?=\n### |\Z)", re.MULTILINE)
-    for match in pattern.finditer(body):
+    # start 总在行首（换行之后），MULTILINE 的 ^ 可以在此匹配
+    for match in HEADING_BLOCK_RE.finditer(text, start):
         role = match.group(1).strip()
         content = match.group(2).strip()
         if content:
@@ -717,22 +833,23 @@ def parse_json_line(line):
     if not line or not line.startswith("{") or not line.endswith("}"):
         return None
     try:
-        return json.loads(line)
+        return json_loads(line)
     except json.JSONDecodeError:
         return None
 
 
-def normalize_body(text, keep_code=False):
-    lines = text.splitlines()
+def iter_clean_lines(body):
+    """逐行清洗消息正文，产出 (in_code, artifact, stripped, cleaned)。
+
+    normalize_body 与 extract_highlights 共用这一次遍历；artifact 为图片/附件行，
+    只参与高亮候选，不进入正文。
+    """
     in_code = False
-    cleaned_lines = []
-    for line in lines:
+    for line in body.splitlines():
         stripped = line.strip()
         if stripped.startswith("```"):
             in_code = not in_code
             continue
-        if in_code and not keep_code:
-            continue
         if not stripped:
             continue
         if stripped.startswith("{") and stripped.endswith("}"):
@@ -740,39 +857,105 @@ def normalize_body(text, keep_code=False):
             if obj:
                 ctype = obj.get("content_type") or ""
                 if "transcription" in ctype and obj.get("text"):
-                    cleaned_lines.append(str(obj["text"]).strip())
-                continue
+                    yield in_code, False, stripped, str(obj["text"]).strip()
             continue
 
-        if "sediment://" in stripped:
-            continue
-        if stripped.startswith("[image]"):
-            continue
-
-        cleaned = CITE_RE.sub("", stripped)
-        cleaned = LIST_PREFIX_RE.sub("", cleaned).strip()
+        artifact = "sediment://" in stripped or stripped.startswith("[image]")
+        # 大多数行既无引用标记也无列表前缀：先用廉价的字符判断，命中才走正则
+        if "\ue200" in stripped:
+            cleaned = CITE_RE.sub("", stripped)
+            cleaned = LIST_PREFIX_RE.sub("", cleaned).strip()
+        elif stripped[0] in LIST_PREFIX_CHARS or stripped[0].isdigit():
+            cleaned = LIST_PREFIX_RE.sub("", stripped).strip()
+        else:
+            cleaned = stripped
         if cleaned:
-            cleaned_lines.append(cleaned)
-    return "\n".join(cleaned_lines)
+            yield in_code, artifact, stripped, cleaned
 
 
-def extract_text(messages, keep_code=False):
-    chunks = []
+def normalize_body(text, keep_code=False):
+    return "\n".join(
+        cleaned
+        for in_code, artifact, _, cleaned in iter_clean_lines(text)
+        if not artifact and (keep_code or not in_code)
+    )
+
+
+def extract_document(messages, highlight_limit=8):
+    """一次遍历所有消息行，同时得到正文、含代码的检索文本、高亮句和主题文本行。
+
+    主题文本行即 strip_artifact_lines(正文) 的结果，顺带在同一次遍历里过滤掉。
+    """
+    plain_chunks = []
+    search_chunks = []
+    term_lines = []
+    candidates = []
+    seen = set()
     for msg in messages:
-        normalized = normalize_body(msg["body"], keep_code=keep_code)
-        if normalized:
-            chunks.append(normalized)
-    return "\n".join(chunks)
+        plain_lines = []
+        search_lines = []
+        for in_code, artifact, stripped, cleaned in iter_clean_lines(msg["body"]):
+            if not artifact:
+                search_lines.append(cleaned)
+                if not in_code:
+                    plain_lines.append(cleaned)
+                    # 转写文本可能自带换行，与 strip_artifact_lines 一样按行处理
+                    for part in cleaned.splitlines():
+                        part = part.strip()
+                        if part and not is_artifact_line(part):
+                            term_lines.append(part)
+            if in_code or len(cleaned) < 6 or len(cleaned) > 180:
+                continue
+            score = 0
+            if HIGHLIGHT_RE.search(cleaned.lower()):
+                score += 2
+            # cleaned 已去掉首尾空白，结尾问号用 endswith 判断即可
+            if cleaned.endswith(QUESTION_MARKS):
+                score += 1
+            first = stripped[0]
+            if (first in LIST_PREFIX_CHARS or first.isdigit()) and LIST_PREFIX_RE.match(stripped):
+                score += 0.5
+            if score > 0 and cleaned not in seen:
+                candidates.append((score, len(candidates), cleaned))
+                seen.add(cleaned)
+        plain = "\n".join(plain_lines)
+        if plain:
+            plain_chunks.append(plain)
+        search = "\n".join(search_lines)
+        if search:
+            search_chunks.append(search)
+    # 只取前 highlight_limit 条：堆选择即可，不必整表排序
+    top = heapq.nsmallest(highlight_limit, candidates, key=lambda item: (-item[0], item[1]))
+    highlights = [text for _, _, text in top]
+    return "\n".join(plain_chunks), "\n".join(search_chunks), highlights, term_lines
+
+
+def extract_text(messages, keep_code=False):
+    text_plain, search_text, _, _ = extract_document(messages)
+    return search_text if keep_code else text_plain
 
 
 def ascii_ratio(text):
-    if not text:
+    if not text or text.isascii():
         return 1.0
-    ascii_count = 0
-    for ch in text:
-        if ord(ch) < 128:
-            ascii_count += 1
-    return ascii_count / max(1, len(text))
+    # encode 时丢弃非 ASCII 字符，剩余长度即 ASCII 字符数
+    return len(text.encode("ascii", "ignore")) / len(text)
+
+
+def is_artifact_line(s):
+    """判断一行（已 strip、非空）是否为堆栈/补丁摘要/路径等噪声。"""
+    # 四个噪声标记各自含有 _ @ < : 之一（lower() 不会产生这些字符），都没有就不必转小写
+    if "_" in s or "@" in s or "<" in s or ":" in s:
+        lower = s.lower()
+        if "node_modules" in lower or "@babel/parser" in lower:
+            return True
+        if "<vite-error-overlay" in lower or "plugin:vite" in lower:
+            return True
+    # 很像“文件改动摘要 / 路径行”；先做廉价判断，文件名必含 "."，再跑正则
+    if "." in s and (":" in s or PLUS_NUMBER_RE.search(s)) and FILE_TOKEN_RE.search(s):
+        return True
+    # 超长且几乎全是 ASCII，常见于堆栈/日志/代码输出
+    return len(s) >= 160 and ascii_ratio(s) >= 0.85
 
 
 def strip_artifact_lines(text):
@@ -780,20 +963,8 @@ def strip_artifact_lines(text):
     kept = []
     for line in text.splitlines():
         s = line.strip()
-        if not s:
-            continue
-        lower = s.lower()
-        if "node_modules" in lower or "@babel/parser" in lower:
-            continue
-        if "<vite-error-overlay" in lower or "plugin:vite" in lower:
-            continue
-        # 很像“文件改动摘要 / 路径行”
-        if FILE_TOKEN_RE.search(s) and (re.search(r"\+\d+", s) or ":" in s):
-            continue
-        # 超长且几乎全是 ASCII，常见于堆栈/日志/代码输出
-        if len(s) >= 160 and ascii_ratio(s) >= 0.85:
-            continue
-        kept.append(s)
+        if s and not is_artifact_line(s):
+            kept.append(s)
     return "\n".join(kept)
 
 
@@ -803,37 +974,6 @@ def base_role(role_label):
     return role_label.split(" ")[0].split(":")[0].strip().lower()
 
 
-def is_tool_call_block(text):
-    stripped = text.strip()
-    if not stripped:
-        return False
-    payload = stripped
-    if stripped.startswith("```"):
-        lines = stripped.splitlines()
-        if not lines:
-            return False
-        fence = lines[0].strip()
-        if not fence.startswith("```"):
-            return False
-        lang = fence[3:].strip().lower()
-        if lang and lang != "unknown":
-            return False
-        if len(lines) < 2:
-            return False
-        if not lines[-1].strip().startswith("```"):
-            return False
-        payload = "\n".join(lines[1:-1]).strip()
-        if not payload:
-            return False
-    try:
-        obj = json.loads(payload)
-    except json.JSONDecodeError:
-        return False
-    if not isinstance(obj, dict):
-        return False
-    return any(key in obj for key in TOOL_JSON_KEYS)
-
-
 def clean_for_metrics(text):
     cleaned = normalize_body(text, keep_code=False)
     cleaned = strip_artifact_lines(cleaned)
@@ -841,14 +981,16 @@ def clean_for_metrics(text):
 
 
 def analyze_user_message(text):
-    compact = re.sub(r"\s+", " ", text).strip()
-    char_len = len(compact.replace(" ", ""))
-    word_len = len(re.findall(r"[A-Za-z0-9']+", compact))
+    # str.split() 与正则 \s+ 判定的空白字符相同，折叠空白无需走正则
+    compact = " ".join(text.split())
+    char_len = len(compact) - compact.count(" ")
+    word_len = len(WORD_RE.findall(compact))
     has_question = "?" in compact or "？" in compact
-    has_request = bool(REQUEST_RE.search(compact))
+    lowered = compact.lower()
+    has_request = bool(REQUEST_RE.search(lowered))
     has_structure = bool(STRUCTURE_RE.search(compact))
-    has_numbers = bool(re.search(r"\d", compact))
-    has_constraints = bool(CONSTRAINT_RE.search(compact) or UNIT_RE.search(compact))
+    has_numbers = bool(DIGIT_RE.search(compact))
+    has_constraints = bool(CONSTRAINT_RE.search(lowered) or UNIT_RE.search(lowered))
     has_context = bool(CONTEXT_RE.search(compact) or char_len >= 35)
     has_feedback = bool(FEEDBACK_RE.search(compact))
     clear = has_question or has_request or has_structure or char_len >= 18 or word_len >= 6
@@ -870,12 +1012,28 @@ def truncate_text(text, limit=180):
     return text[: limit - 1].rstrip() + "…"
 
 
+def quote_sort_key(item):
+    return -item.get("score", 0), item.get("text", "")
+
+
 def push_quote(bucket, quote, limit=60):
-    bucket.append(quote)
-    if len(bucket) <= limit:
+    """把引用插入按 quote_sort_key 有序的 bucket，只保留前 limit 条。
+
+    二分查找插入位置（同分同文本时排在已有条目之后），不再每次溢出都整表重排。
+    """
+    key = quote_sort_key(quote)
+    lo, hi = 0, len(bucket)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key < quote_sort_key(bucket[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    if lo >= limit:
         return
-    bucket.sort(key=lambda item: (-item.get("score", 0), item.get("text", "")))
-    del bucket[limit:]
+    bucket.insert(lo, quote)
+    if len(bucket) > limit:
+        bucket.pop()
 
 
 def analyze_conversation(messages, file_path, created_utc, totals, quote_buckets, boundary_quotes):
@@ -900,15 +1058,16 @@ def analyze_conversation(messages, file_path, created_utc, totals, quote_buckets
     totals["conversations"] += 1
     totals["user_messages"] += len(user_msgs)
     totals["assistant_messages"] += len(assistant_msgs)
-    totals["user_chars"] += sum(len(text.replace(" ", "")) for text in user_msgs)
+    totals["user_chars"] += sum(len(text) - text.count(" ") for text in user_msgs)
     totals["assistant_chars"] += sum(
-        len(text.replace(" ", "")) for text in assistant_msgs
+        len(text) - text.count(" ") for text in assistant_msgs
     )
 
+    clarify_hits = 0
     for text in assistant_msgs:
         if CLARIFY_RE.search(text):
-            totals["clarify_hits"] += 1
-        if BOUNDARY_RE.search(text):
+            clarify_hits += 1
+        if BOUNDARY_RE.search(text.lower()):
             push_quote(
                 boundary_quotes,
                 {
@@ -926,61 +1085,38 @@ def analyze_conversation(messages, file_path, created_utc, totals, quote_buckets
     vague_hits = 0
     for text in user_msgs:
         metrics = analyze_user_message(text)
+        # 同一条消息命中多个类别时共用一份引用（只读），截断也只做一次
+        quote = {
+            "text": truncate_text(metrics["text"]),
+            "file": file_path,
+            "score": metrics["char_len"],
+        }
         if metrics["clear"]:
             clear_hits += 1
-            totals["clarity_hits"] += 1
-            push_quote(
-                quote_buckets["clarity"],
-                {
-                    "text": truncate_text(metrics["text"]),
-                    "file": file_path,
-                    "score": metrics["char_len"],
-                },
-            )
+            push_quote(quote_buckets["clarity"], quote)
         if metrics["constraint"]:
             constraint_hits += 1
-            totals["constraint_hits"] += 1
-            push_quote(
-                quote_buckets["constraint"],
-                {
-                    "text": truncate_text(metrics["text"]),
-                    "file": file_path,
-                    "score": metrics["char_len"],
-                },
-            )
+            push_quote(quote_buckets["constraint"], quote)
         if metrics["context"]:
             context_hits += 1
-            totals["context_hits"] += 1
-            push_quote(
-                quote_buckets["context"],
-                {
-                    "text": truncate_text(metrics["text"]),
-                    "file": file_path,
-                    "score": metrics["char_len"],
-                },
-            )
+            push_quote(quote_buckets["context"], quote)
         if metrics["feedback"]:
             feedback_hits += 1
-            totals["feedback_hits"] += 1
-            push_quote(
-                quote_buckets["feedback"],
-                {
-                    "text": truncate_text(metrics["text"]),
-                    "file": file_path,
-                    "score": metrics["char_len"],
-                },
-            )
+            push_quote(quote_buckets["feedback"], quote)
         if metrics["vague"]:
             vague_hits += 1
             push_quote(
                 quote_buckets["vague"],
-                {
-                    "text": truncate_text(metrics["text"]),
-                    "file": file_path,
-                    "score": 100 - metrics["char_len"],
-                },
+                {**quote, "score": 100 - metrics["char_len"]},
             )
 
+    # 计数先累加在局部变量里，每条对话只回写一次 totals
+    totals["clarify_hits"] += clarify_hits
+    totals["clarity_hits"] += clear_hits
+    totals["constraint_hits"] += constraint_hits
+    totals["context_hits"] += context_hits
+    totals["feedback_hits"] += feedback_hits
+
     user_count = max(1, len(user_msgs))
     clarity_rate = clear_hits / user_count
     constraint_rate = constraint_hits / user_count
@@ -1008,14 +1144,16 @@ def analyze_conversation(messages, file_path, created_utc, totals, quote_buckets
     }
 
 
-def compute_cluster_trends(items, interaction_records, min_points=6):
+def compute_cluster_trends(items, interaction_records, min_points=6, item_dts=None):
+    """item_dts 为与 items 对齐的已解析 created_utc（可选），避免重复解析时间。"""
+    if item_dts is None:
+        item_dts = [parse_datetime(item.get("created_utc") or "") for item in items]
     cluster_points = {}
-    for item in items:
+    for item, dt in zip(items, item_dts):
         file_path = item.get("file") or ""
         record = interaction_records.get(file_path)
         if not record:
             continue
-        dt = parse_datetime(item.get("created_utc") or "")
         if not dt:
             continue
         cluster = item.get("cluster_label") or "其他"
@@ -1055,7 +1193,9 @@ def compute_cluster_trends(items, interaction_records, min_points=6):
     }
 
 
-def build_interaction_report(items, interaction_records, totals, quote_buckets, boundary_quotes, generated_utc):
+def build_interaction_report(
+    items, interaction_records, totals, quote_buckets, boundary_quotes, generated_utc, item_dts=None
+):
     total_user = totals["user_messages"]
     total_assistant = totals["assistant_messages"]
     total_conversations = totals["conversations"]
@@ -1207,7 +1347,6 @@ def build_interaction_report(items, interaction_records, totals, quote_buckets,
         bucket = quote_buckets.get(key) or []
         if not bucket:
             continue
-        bucket.sort(key=lambda item: (-item.get("score", 0), item.get("text", "")))
         for candidate in bucket:
             if candidate["file"] in used_files:
                 continue
@@ -1223,15 +1362,12 @@ def build_interaction_report(items, interaction_records, totals, quote_buckets,
         if len(quotes) >= 5:
             break
 
-    boundary_quotes.sort(
-        key=lambda item: (-item.get("score", 0), item.get("text", ""))
-    )
     boundaries = [
         {"label": "能力边界提示", "text": item["text"], "file": item["file"]}
         for item in boundary_quotes[:4]
     ]
 
-    cluster_trends = compute_cluster_trends(items, interaction_records)
+    cluster_trends = compute_cluster_trends(items, interaction_records, item_dts=item_dts)
 
     return {
         "generated_utc": generated_utc,
@@ -1246,52 +1382,7 @@ def build_interaction_report(items, interaction_records, totals, quote_buckets,
 
 
 def extract_highlights(messages, limit=8):
-    candidates = []
-    seen = set()
-    line_index = 0
-    for msg in messages:
-        lines = msg["body"].splitlines()
-        in_code = False
-        for line in lines:
-            stripped = line.strip()
-            if stripped.startswith("```"):
-                in_code = not in_code
-                line_index += 1
-                continue
-            if in_code or not stripped:
-                line_index += 1
-                continue
-            if stripped.startswith("{") and stripped.endswith("}"):
-                obj = parse_json_line(stripped)
-                if obj:
-                    ctype = obj.get("content_type") or ""
-                    if "transcription" in ctype and obj.get("text"):
-                        cleaned = str(obj["text"]).strip()
-                    else:
-                        line_index += 1
-                        continue
-                else:
-                    line_index += 1
-                    continue
-            else:
-                cleaned = CITE_RE.sub("", stripped)
-                cleaned = LIST_PREFIX_RE.sub("", cleaned).strip()
-            if len(cleaned) < 6 or len(cleaned) > 180:
-                line_index += 1
-                continue
-            score = 0
-            if HIGHLIGHT_RE.search(cleaned):
-                score += 2
-            if QUESTION_RE.search(cleaned):
-                score += 1
-            if LIST_PREFIX_RE.match(stripped):
-                score += 0.5
-            if score > 0 and cleaned not in seen:
-                candidates.append((score, line_index, cleaned))
-                seen.add(cleaned)
-            line_index += 1
-    candidates.sort(key=lambda item: (-item[0], item[1]))
-    return [text for _, _, text in candidates[:limit]]
+    return extract_document(messages, highlight_limit=limit)[2]
 
 
 def tokenize(text):
@@ -1299,22 +1390,34 @@ def tokenize(text):
     return tokenize_v2(text, zh_vocab=None)
 
 
+@lru_cache(maxsize=1 << 16)
+def is_chinese_term(term):
+    return ZH_CHAR_RE.search(term) is not None
+
+
+@lru_cache(maxsize=1 << 18)
 def normalize_term(term):
     if not term:
         return None
     t = term.strip()
     if not t:
         return None
-    # 先统一英文小写做映射，再用映射后的显示形式
+    # 先统一英文小写；别名/停用词/噪声词的结果已预先算好，命中即返回
     lower = t.lower()
-    mapped = TERM_ALIASES.get(lower) or TERM_ALIASES.get(t) or t
+    if lower in TERM_TABLE:
+        return TERM_TABLE[lower]
+    return filter_term(t, lower)
+
+
+def filter_term(mapped, mapped_lower):
     # 归一后再做 stopwords/noise 过滤（英文以 lower 判断）
-    mapped_lower = mapped.lower()
-    if is_noise_term(mapped):
+    if mapped_lower in DROP_TERMS:
         return None
-    if mapped_lower in EN_STOPWORDS or mapped_lower in NOISE_TERMS:
-        return None
-    if mapped in ZH_STOPWORDS:
+    if (
+        TURN_TOKEN_RE.match(mapped_lower)
+        or SHORT_ID_RE.match(mapped_lower)
+        or MIXED_ID_RE.match(mapped_lower)
+    ):
         return None
     if mapped_lower.startswith("http"):
         return None
@@ -1344,6 +1447,16 @@ def is_noise_term(term):
     return False
 
 
+# lower 形式 -> normalize_term 的结果（None 表示丢弃）
+TERM_TABLE = {
+    **dict.fromkeys(DROP_TERMS),
+    **{
+        alias: filter_term(display, display.lower())
+        for alias, display in TERM_ALIASES.items()
+    },
+}
+
+
 def iter_zh_ngrams(seq, min_len=2, max_len=4):
     length = len(seq)
     for n in range(min_len, max_len + 1):
@@ -1353,34 +1466,149 @@ def iter_zh_ngrams(seq, min_len=2, max_len=4):
             yield seq[i : i + n]
 
 
-def build_zh_vocab(texts, min_df=None, max_df_ratio=0.35):
-    """用语料自举一个 2~4 字的中文词表，用于最大匹配分词。"""
+def extract_term_hits(text):
+    """对主题文本做一次正则扫描，返回 (英文词, 全文中文串, 截断后中文串)。
+
+    全文中文串用于 build_zh_vocab，截断部分（前 MAX_TEXT_CHARS_FOR_TERMS 字）用于分词。
+    """
+    limited = text[:MAX_TEXT_CHARS_FOR_TERMS]
+    if text.isascii():
+        # 纯 ASCII（如全英文对话）不可能含中文串，省掉中文扫描
+        return EN_RE.findall(limited), [], []
+    zh_seqs = ZH_RE.findall(text)
+    if len(text) <= MAX_TEXT_CHARS_FOR_TERMS:
+        zh_limited = zh_seqs
+    else:
+        zh_limited = ZH_RE.findall(limited)
+    return EN_RE.findall(limited), zh_seqs, zh_limited
+
+
+def build_zh_vocab(doc_zh_seqs, min_df=None, max_df_ratio=0.35):
+    """用语料自举一个 2~4 字的中文词表，用于最大匹配分词。
+
+    doc_zh_seqs 为每篇文档的中文连续串列表（见 extract_term_hits）。
+    """
     df = Counter()
-    for text in texts:
+    for zh_seqs in doc_zh_seqs:
         seen = set()
-        for seq in ZH_RE.findall(text):
+        # 文档内重复出现的中文串只需切一次 n-gram（seen 本身就是集合语义）
+        for seq in set(zh_seqs):
             # 避免超长连续串造成爆炸
             if len(seq) > 180:
                 seq = seq[:180]
-            for term in iter_zh_ngrams(seq, 2, 4):
-                if term in ZH_STOPWORDS:
-                    continue
-                # 过滤“哈哈哈哈/啊啊啊”这类重复
-                if len(set(term)) == 1:
-                    continue
-                seen.add(term)
-        for term in seen:
-            df[term] += 1
-    total = max(1, len(texts))
+            length = len(seq)
+            for n in (2, 3, 4):
+                seen.update([seq[i : i + n] for i in range(length - n + 1)])
+        df.update(seen)
+    total = max(1, len(doc_zh_seqs))
     if min_df is None:
         min_df = 2 if total < 80 else 3
     max_df = int(total * max_df_ratio)
-    vocab = {t for t, c in df.items() if c >= min_df and c <= max_df}
+    # 停用词与“哈哈哈哈/啊啊啊”这类重复只和词本身有关，计数后统一过滤一次
+    vocab = {
+        t
+        for t, c in df.items()
+        if min_df <= c <= max_df and t not in ZH_STOPWORDS and len(set(t)) > 1
+    }
     vocab |= set(DOMAIN_ZH_TERMS)
     return vocab
 
 
-def segment_zh(seq, vocab):
+ZH_VOCAB_CACHE_KEEP = 4
+# build_zh_vocab / build_zh_automaton 的逻辑或缓存格式变化时递增，使旧缓存失效
+ZH_VOCAB_CACHE_VERSION = 1
+
+
+def load_or_build_zh_vocab(doc_zh_seqs, cache_dir=None, min_df=None, max_df_ratio=0.35):
+    """返回 (中文词表, 自动机)；给定 cache_dir 时按语料哈希缓存到磁盘，语料不变则跳过自举。
+
+    缓存键还包含格式版本、文档数、阈值以及停用词/领域词表，任何一项变化都会重建。
+    """
+    if not cache_dir:
+        zh_vocab = build_zh_vocab(doc_zh_seqs, min_df=min_df, max_df_ratio=max_df_ratio)
+        return zh_vocab, build_zh_automaton(zh_vocab)
+
+    digest = hashlib.blake2b(digest_size=16)
+    header = (
+        ZH_VOCAB_CACHE_VERSION,
+        len(doc_zh_seqs),
+        min_df,
+        max_df_ratio,
+        sorted(ZH_STOPWORDS),
+        sorted(DOMAIN_ZH_TERMS),
+    )
+    digest.update(repr(header).encode("utf-8"))
+    digest.update(b"\x02")
+    for zh_seqs in doc_zh_seqs:
+        digest.update("\x00".join(zh_seqs).encode("utf-8"))
+        digest.update(b"\x01")
+    cache_path = os.path.join(cache_dir, f"zh_vocab_{digest.hexdigest()}.pkl")
+
+    try:
+        with open(cache_path, "rb") as f:
+            zh_vocab, zh_automaton = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ImportError, ValueError, TypeError):
+        zh_vocab = None
+    if zh_vocab is not None:
+        # 缓存写入时可能还没装 pyahocorasick
+        if zh_automaton is None:
+            zh_automaton = build_zh_automaton(zh_vocab)
+        try:
+            # 刷新修改时间，供按时间清理旧缓存时识别仍在使用的条目；只读或他人的文件不影响命中
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return zh_vocab, zh_automaton
+
+    zh_vocab = build_zh_vocab(doc_zh_seqs, min_df=min_df, max_df_ratio=max_df_ratio)
+    zh_automaton = build_zh_automaton(zh_vocab)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 先写临时文件再改名：中途中断也不会在正式文件名下留下半截缓存
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix="zh_vocab_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((zh_vocab, zh_automaton), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    # 只保留最近使用的几份缓存
+    cached = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir)
+        if name.startswith("zh_vocab_") and name.endswith(".pkl")
+    ]
+    cached.sort(key=os.path.getmtime, reverse=True)
+    for stale in cached[ZH_VOCAB_CACHE_KEEP:]:
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+    return zh_vocab, zh_automaton
+
+
+def build_zh_automaton(vocab):
+    """把词表编译成 Aho-Corasick 自动机（需要 pyahocorasick），一次扫描找出所有候选词。"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for term in vocab:
+        # segment_zh 只匹配 2~4 字且非停用词的候选
+        if 2 <= len(term) <= 4 and term not in ZH_STOPWORDS:
+            automaton.add_word(term, len(term))
+    if not len(automaton):
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+def segment_zh(seq, vocab, automaton=None):
+    if automaton is not None:
+        return segment_zh_automaton(seq, automaton)
     tokens = []
     i = 0
     length = len(seq)
@@ -1401,20 +1629,45 @@ def segment_zh(seq, vocab):
     return tokens
 
 
-def tokenize_v2(text, zh_vocab):
+def segment_zh_automaton(seq, automaton):
+    # 记录每个起点的最长匹配，再按与 segment_zh 相同的贪心规则从左到右取词
+    length = len(seq)
+    longest = [0] * length
+    for end, n in automaton.iter(seq):
+        start = end - n + 1
+        if n > longest[start]:
+            longest[start] = n
     tokens = []
+    i = 0
+    while i < length:
+        n = longest[i]
+        if n:
+            tokens.append(seq[i : i + n])
+            i += n
+        else:
+            i += 1
+    return tokens
+
+
+def tokenize_v2(text, zh_vocab, zh_automaton=None):
     if not text:
-        return tokens
+        return []
     limited = text[:MAX_TEXT_CHARS_FOR_TERMS]
+    return tokenize_hits(
+        EN_RE.findall(limited), ZH_RE.findall(limited), zh_vocab, zh_automaton
+    )
+
 
-    for word in EN_RE.findall(limited):
+def tokenize_hits(en_words, zh_seqs, zh_vocab, zh_automaton=None):
+    tokens = []
+    for word in en_words:
         w = normalize_term(word)
         if not w:
             continue
         tokens.append(w)
 
     # 中文：用语料词表做最大匹配分词（比 4 字切块更稳）
-    for seq in ZH_RE.findall(limited):
+    for seq in zh_seqs:
         if seq in ZH_STOPWORDS:
             continue
         if not zh_vocab:
@@ -1424,21 +1677,50 @@ def tokenize_v2(text, zh_vocab):
                 if mapped:
                     tokens.append(mapped)
             continue
-        for term in segment_zh(seq, zh_vocab):
+        for term in segment_zh(seq, zh_vocab, zh_automaton):
             mapped = normalize_term(term)
             if mapped:
                 tokens.append(mapped)
     return tokens
 
 
-def is_chinese_term(term):
-    return any("\u4e00" <= ch <= "\u9fff" for ch in term)
+# 子进程分词时共享的中文词表/自动机，由 init_term_count_worker 在进程启动时设置一次
+WORKER_ZH_VOCAB = None
+WORKER_ZH_AUTOMATON = None
+
+
+def init_term_count_worker(zh_vocab, zh_automaton):
+    global WORKER_ZH_VOCAB, WORKER_ZH_AUTOMATON
+    WORKER_ZH_VOCAB = zh_vocab
+    WORKER_ZH_AUTOMATON = zh_automaton
+
+
+def count_doc_terms(hits):
+    en_words, zh_limited = hits
+    return Counter(tokenize_hits(en_words, zh_limited, WORKER_ZH_VOCAB, WORKER_ZH_AUTOMATON))
+
+
+def iter_doc_term_counts(doc_term_hits, zh_vocab, zh_automaton, workers=1):
+    """按文档顺序产出词频 Counter；文档足够多时把分词分发到进程池。"""
+    # 只把分词要用的部分发给子进程，全文中文串（仅用于建词表）不必再序列化
+    tasks = ((en_words, zh_limited) for en_words, _, zh_limited in doc_term_hits)
+    return iter_batched_map(
+        count_doc_terms,
+        tasks,
+        workers=workers,
+        initializer=init_term_count_worker,
+        initargs=(zh_vocab, zh_automaton),
+    )
 
 
 def mix_keywords(counter, limit=40):
-    terms = [term for term, _ in counter.most_common()]
-    zh_terms = [term for term in terms if is_chinese_term(term)]
-    en_terms = [term for term in terms if not is_chinese_term(term)]
+    # 每组最多用到 limit 个：nlargest 与 most_common 排序结果一致，但不必全量排序
+    zh_terms = heapq.nlargest(
+        limit, (term for term in counter if is_chinese_term(term)), key=counter.__getitem__
+    )
+    en_terms = heapq.nlargest(
+        limit, (term for term in counter if not is_chinese_term(term)), key=counter.__getitem__
+    )
     combined = []
     zh_idx = 0
     en_idx = 0
@@ -1457,21 +1739,23 @@ def mix_keywords(counter, limit=40):
 def is_good_keyword(term, doc_freq, total_docs):
     if not term:
         return False
-    lower = term.lower()
-    if lower in KEYWORD_BLACKLIST:
-        return False
-    if is_noise_term(term):
-        return False
-    if term in ZH_STOPWORDS:
-        return False
-    if lower in EN_STOPWORDS or lower in NOISE_TERMS:
-        return False
     df = doc_freq.get(term, 0)
     if df < 2:
         return False
     # 过于常见也不当关键词（像“可以/应该/问题”那类）
     if df > int(total_docs * 0.6):
         return False
+    return is_keyword_shaped(term)
+
+
+@lru_cache(maxsize=1 << 16)
+def is_keyword_shaped(term):
+    """只看词本身的关键词过滤（与文档频率无关），按词缓存，避免重复 lower()。"""
+    lower = term.lower()
+    if lower in KEYWORD_DROP_TERMS:
+        return False
+    if is_noise_term(term):
+        return False
     # 非中文过短也别当关键词（保留白名单）
     if not is_chinese_term(term) and len(lower) <= 2 and lower not in SHORT_ALLOW:
         return False
@@ -1479,39 +1763,35 @@ def is_good_keyword(term, doc_freq, total_docs):
     if term.isascii():
         if "_" in term and len(term) >= 6:
             return False
-        if term and term[0].islower() and any(ch.isupper() for ch in term[1:]):
+        if CAMEL_CASE_RE.match(term):
             return False
-        if term.endswith(("Service", "Panel", "Dashboard", "Interface", "Provider", "Controller", "Manager")):
+        if term.endswith(IDENTIFIER_SUFFIXES):
             return False
     return True
 
 
-def tfidf_keywords(term_counts, idf, doc_freq, total_docs, limit=8):
-    scored = []
-    for term, tf in term_counts.items():
-        if not is_good_keyword(term, doc_freq, total_docs):
-            continue
-        if tf <= 0:
-            continue
-        weight = (1.0 + math.log(tf)) * idf.get(term, 1.0)
-        scored.append((weight, tf, term))
-    scored.sort(key=lambda item: (-item[0], -item[1], item[2]))
-    return [term for _, _, term in scored[:limit]]
+def tfidf_keywords(term_counts, keyword_idf, limit=8):
+    """keyword_idf 只含通过 is_good_keyword 的词（词 -> idf），过滤与全局 df 相关，整库只算一次。"""
+    scored = (
+        ((1.0 + math.log(tf)) * keyword_idf[term], tf, term)
+        for term, tf in term_counts.items()
+        if tf > 0 and term in keyword_idf
+    )
+    top = heapq.nsmallest(limit, scored, key=lambda item: (-item[0], -item[1], item[2]))
+    return [term for _, _, term in top]
 
 
 def assign_topic_label(term_counts, fallback_keywords, doc_freq, total_docs, min_fallback_df=None):
     # 用小规则优先聚合到“大类”
-    # 为了兼容大小写，把 term 统一成 lower 做命中
-    lower_counts = Counter()
+    # 为了兼容大小写，把 term 统一成 lower 做命中；每个词只查一次倒排表
+    scores = [0] * len(TOPIC_RULES)
     for term, count in term_counts.items():
-        lower_counts[term.lower()] += count
+        for rule_idx in TOPIC_TRIGGERS.get(term.lower(), ()):
+            scores[rule_idx] += count
 
     best_label = None
     best_score = 0
-    for label, triggers in TOPIC_RULES:
-        score = 0
-        for trig in triggers:
-            score += lower_counts.get(trig.lower(), 0)
+    for (label, _), score in zip(TOPIC_RULES, scores):
         if score > best_score:
             best_label = label
             best_score = score
@@ -1524,8 +1804,7 @@ def assign_topic_label(term_counts, fallback_keywords, doc_freq, total_docs, min
     for kw in fallback_keywords:
         if not kw:
             continue
-        if kw.lower() in KEYWORD_BLACKLIST:
-            continue
+        # is_good_keyword 已包含 KEYWORD_BLACKLIST 过滤
         if not is_good_keyword(kw, doc_freq, total_docs):
             continue
         if doc_freq.get(kw, 0) >= min_fallback_df:
@@ -1533,45 +1812,62 @@ def assign_topic_label(term_counts, fallback_keywords, doc_freq, total_docs, min
     return "其他"
 
 
-def write_search_index(out_dir, entries, shard_size, generated_utc):
+def dedupe_search_prefixes(shard_entries):
+    """把分片内重复出现的 search_text 前缀（样板、系统提示等）提到共享表。
+
+    命中的条目 search_text 改写为 {"p": 表下标, "rest": 剩余文本}，其余保持字符串。
+    """
+    prefix_counts = Counter(
+        entry["search_text"][:SEARCH_PREFIX_CHARS]
+        for entry in shard_entries
+        if len(entry["search_text"]) >= SEARCH_PREFIX_CHARS
+    )
+    header_strings = []
+    header_index = {}
+    items = []
+    for entry in shard_entries:
+        text = entry["search_text"]
+        prefix = text[:SEARCH_PREFIX_CHARS]
+        if len(prefix) < SEARCH_PREFIX_CHARS or prefix_counts[prefix] < 2:
+            items.append(entry)
+            continue
+        idx = header_index.get(prefix)
+        if idx is None:
+            idx = header_index[prefix] = len(header_strings)
+            header_strings.append(prefix)
+        items.append({**entry, "search_text": {"p": idx, "rest": text[SEARCH_PREFIX_CHARS:]}})
+    return header_strings, items
+
+
+def write_search_index(out_dir, entries, shard_size, generated_utc, compress=True):
     os.makedirs(out_dir, exist_ok=True)
     shards = []
     if shard_size <= 0:
         shard_size = len(entries) or 1
     for idx in range(0, len(entries), shard_size):
         shard_entries = entries[idx : idx + shard_size]
+        header_strings, items = dedupe_search_prefixes(shard_entries)
+        data = json_dumps_bytes({"header_strings": header_strings, "items": items})
         name = f"search_{idx // shard_size:04d}.json"
-        with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
-            json.dump({"items": shard_entries}, f, ensure_ascii=False)
+        if compress:
+            name += ".gz"
+            # mtime=0 让相同输入产出相同字节，重复构建不会产生无意义的差异
+            data = gzip.compress(data, compresslevel=SEARCH_GZIP_LEVEL, mtime=0)
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(data)
         shards.append({"file": name, "count": len(shard_entries)})
     manifest = {
+        "format": SEARCH_SHARD_FORMAT,
         "generated_utc": generated_utc,
         "total": len(entries),
         "shards": shards,
     }
-    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(out_dir, "manifest.json"), "wb") as f:
+        f.write(json_dumps_indented(manifest))
 
 
-def build_index(
-    csv_path,
-    root_dir,
-    out_path,
-    snippet_len,
-    file_root,
-    search_index_dir=None,
-    search_max_chars=8000,
-    search_shard_size=300,
-    include_search_text=False,
-    interaction_out=None,
-):
-    items = []
-    month_counts = Counter()
-    term_texts = []
-    raw_rows = []
-    search_entries = []
-    interaction_records = {}
-    interaction_totals = {
+def new_interaction_totals():
+    return {
         "conversations": 0,
         "user_messages": 0,
         "assistant_messages": 0,
@@ -1584,13 +1880,136 @@ def build_index(
         "user_chars": 0,
         "assistant_chars": 0,
     }
-    quote_buckets = {
+
+
+def new_quote_buckets():
+    return {
         "clarity": [],
         "constraint": [],
         "context": [],
         "feedback": [],
         "vague": [],
     }
+
+
+def analyze_row(row, root_dir, snippet_len, file_root, search_max_chars):
+    """处理 index.csv 的一行：读取对话、抽取文本并做交互分析（可在子进程中运行）。"""
+    rel_file = row.get("file") or ""
+    abs_file = os.path.join(root_dir, rel_file)
+    try:
+        md_text = read_text(abs_file)
+    except FileNotFoundError:
+        messages = []
+    else:
+        messages = parse_messages(md_text)
+
+    text_plain, search_text, highlights, term_lines = extract_document(messages)
+    search_text = " ".join(search_text.split())
+    if search_max_chars and search_text.isascii():
+        # ASCII 的 lower() 逐字符且不改变长度，先截断可少转换一大段文本
+        search_text = search_text[:search_max_chars]
+    search_text = search_text.lower()
+    if search_max_chars and len(search_text) > search_max_chars:
+        search_text = search_text[:search_max_chars]
+    snippet = text_plain[:snippet_len].strip()
+
+    created = row.get("created_utc") or ""
+    file_path = os.path.join(file_root, rel_file) if rel_file else ""
+    file_path = file_path.replace("\\", "/")
+    # 统计量与引用先记在本行的局部容器里，由主进程按顺序合并
+    totals = new_interaction_totals()
+    quote_buckets = new_quote_buckets()
+    boundary_quotes = []
+    record = analyze_conversation(
+        messages,
+        file_path,
+        created,
+        totals,
+        quote_buckets,
+        boundary_quotes,
+    )
+
+    item = {
+        "index": int(row.get("index") or 0),
+        "title": row.get("title") or "Untitled",
+        "created_utc": created,
+        "updated_utc": row.get("updated_utc") or "",
+        "messages": int(row.get("messages") or 0),
+        "file": file_path,
+        "snippet": snippet,
+        "keywords": [],
+        "highlights": highlights,
+    }
+    # 等价于 strip_artifact_lines(标题 + 正文)，正文部分已在 extract_document 中过滤
+    title_lines = strip_artifact_lines(row.get("title") or "")
+    if title_lines:
+        term_lines.insert(0, title_lines)
+    term_text = "\n".join(term_lines)
+    term_hits = extract_term_hits(term_text)
+    return item, search_text, term_hits, record, totals, quote_buckets, boundary_quotes
+
+
+def iter_analyzed_rows(
+    rows, root_dir, snippet_len, file_root, search_max_chars, workers=1
+):
+    task = partial(
+        analyze_row,
+        root_dir=root_dir,
+        snippet_len=snippet_len,
+        file_root=file_root,
+        search_max_chars=search_max_chars,
+    )
+    return iter_batched_map(task, rows, workers=workers)
+
+
+def write_index_json(path, generated_utc, items, insights):
+    """逐条写出 index.json 的 items，避免一次性序列化整个载荷。
+
+    输出与 json_dumps_indented({"generated_utc", "total", "items", "insights"}) 逐字节相同：
+    JSON 字符串里的换行都已转义，所以给每行补缩进只需替换 b"\\n"。
+    """
+    with open(path, "wb") as f:
+        f.write(b'{\n  "generated_utc": ')
+        f.write(json_dumps_indented(generated_utc))
+        f.write(b',\n  "total": %d,\n  "items": ' % len(items))
+        if items:
+            f.write(b"[\n")
+            for idx, item in enumerate(items):
+                if idx:
+                    f.write(b",\n")
+                f.write(b"    ")
+                f.write(json_dumps_indented(item).replace(b"\n", b"\n    "))
+            f.write(b"\n  ]")
+        else:
+            f.write(b"[]")
+        f.write(b',\n  "insights": ')
+        f.write(json_dumps_indented(insights).replace(b"\n", b"\n  "))
+        f.write(b"\n}")
+
+
+def build_index(
+    csv_path,
+    root_dir,
+    out_path,
+    snippet_len,
+    file_root,
+    search_index_dir=None,
+    search_max_chars=8000,
+    search_shard_size=300,
+    include_search_text=False,
+    interaction_out=None,
+    workers=1,
+    vocab_cache_dir=None,
+    search_gzip=True,
+):
+    items = []
+    item_dts = []
+    month_counts = Counter()
+    doc_term_hits = []
+    search_entries = []
+    interaction_records = {}
+    interaction_totals = new_interaction_totals()
+    quote_buckets = new_quote_buckets()
     boundary_quotes = []
     csv_dir = os.path.dirname(os.path.abspath(csv_path))
     if not root_dir:
@@ -1598,87 +2017,75 @@ def build_index(
 
     with open(csv_path, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
-        for row in reader:
-            raw_rows.append(row)
-            rel_file = row.get("file") or ""
-            abs_file = os.path.join(root_dir, rel_file)
-            messages = []
-            if os.path.exists(abs_file):
-                with open(abs_file, "r", encoding="utf-8") as conv_file:
-                    messages = parse_messages(conv_file.read())
-
-            text_plain = extract_text(messages, keep_code=False)
-            search_text = extract_text(messages, keep_code=True)
-            search_text = re.sub(r"\s+", " ", search_text).lower().strip()
-            if search_max_chars and len(search_text) > search_max_chars:
-                search_text = search_text[:search_max_chars]
-            snippet = text_plain[:snippet_len].strip()
-            highlights = extract_highlights(messages)
-
-            created = row.get("created_utc") or ""
-            dt = parse_datetime(created)
+        results = iter_analyzed_rows(
+            reader, root_dir, snippet_len, file_root, search_max_chars, workers=workers
+        )
+        for result in results:
+            item, search_text, term_hits, record, totals, row_quotes, row_boundaries = (
+                result
+            )
+            dt = parse_datetime(item["created_utc"])
+            item_dts.append(dt)
             if dt:
                 month_counts[dt.strftime("%Y-%m")] += 1
 
-            file_path = os.path.join(file_root, rel_file) if rel_file else ""
-            record = analyze_conversation(
-                messages,
-                file_path.replace("\\", "/"),
-                created,
-                interaction_totals,
-                quote_buckets,
-                boundary_quotes,
-            )
+            file_path = item["file"]
             if record:
-                interaction_records[file_path.replace("\\", "/")] = record
-
-            item = {
-                "index": int(row.get("index") or 0),
-                "title": row.get("title") or "Untitled",
-                "created_utc": created,
-                "updated_utc": row.get("updated_utc") or "",
-                "messages": int(row.get("messages") or 0),
-                "file": file_path.replace("\\", "/"),
-                "snippet": snippet,
-                "keywords": [],
-                "highlights": highlights,
-            }
+                interaction_records[file_path] = record
+            for key, value in totals.items():
+                interaction_totals[key] += value
+            for key, quotes in row_quotes.items():
+                for quote in quotes:
+                    push_quote(quote_buckets[key], quote)
+            for quote in row_boundaries:
+                push_quote(boundary_quotes, quote, limit=40)
+
             if include_search_text:
                 item["search_text"] = search_text
             items.append(item)
             if search_index_dir is not None:
                 search_entries.append(
                     {
-                        "file": file_path.replace("\\", "/"),
+                        "file": file_path,
                         "title": item["title"],
                         "search_text": search_text,
                     }
                 )
-            term_texts.append(strip_artifact_lines(f"{row.get('title') or ''}\n{text_plain}"))
+            doc_term_hits.append(term_hits)
 
     # 1) 先自举中文词表，改善中文分词
-    zh_vocab = build_zh_vocab(term_texts)
+    zh_vocab, zh_automaton = load_or_build_zh_vocab(
+        [zh_seqs for _, zh_seqs, _ in doc_term_hits], vocab_cache_dir
+    )
 
     # 2) 文档词频/文档频率（用于 TF-IDF）
     doc_term_counts = []
     doc_freq = Counter()
-    for text in term_texts:
-        terms = tokenize_v2(text, zh_vocab=zh_vocab)
-        counts = Counter(terms)
+    for counts in iter_doc_term_counts(doc_term_hits, zh_vocab, zh_automaton, workers=workers):
         doc_term_counts.append(counts)
         doc_freq.update(counts.keys())
+    # 正则命中列表只用于分词，尽早释放以降低后续序列化阶段的峰值内存
+    del doc_term_hits
 
     total_docs = max(1, len(items))
-    idf = {
-        term: (math.log((total_docs + 1) / (df + 1)) + 1.0)
+    # df 只有少量不同取值：每个取值只算一次 log，再按词查表
+    idf_by_df = {
+        df: (math.log((total_docs + 1) / (df + 1)) + 1.0)
+        for df in set(doc_freq.values())
+    }
+    # 关键词过滤只取决于词本身和全局 df：每个词判定一次，而不是每篇文档每个词都判定
+    keyword_idf = {
+        term: idf_by_df[df]
         for term, df in doc_freq.items()
+        if is_good_keyword(term, doc_freq, total_docs)
     }
 
     # 3) 每条对话的关键词（TF-IDF）+ 主题（规则优先，关键词兜底）
     for item, counts in zip(items, doc_term_counts):
-        keywords = tfidf_keywords(counts, idf, doc_freq, total_docs, limit=8)
+        keywords = tfidf_keywords(counts, keyword_idf, limit=8)
         item["keywords"] = keywords
         item["cluster_label"] = assign_topic_label(counts, keywords, doc_freq, total_docs)
+    del doc_term_counts
 
     cluster_counts = Counter(item.get("cluster_label") or "其他" for item in items)
     clusters = [
@@ -1688,31 +2095,39 @@ def build_index(
 
     # 4) 热词：用“出现于多少条对话”更稳（避免某一两条超长对话拉爆）
     #    只保留可作为关键词的词
-    keyword_candidates = [
-        term
-        for term, _ in doc_freq.most_common()
-        if is_good_keyword(term, doc_freq, total_docs)
-    ]
     top_terms = []
     for pinned in PINNED_KEYWORDS:
-        if pinned in doc_freq and is_good_keyword(pinned, doc_freq, total_docs):
+        if pinned in keyword_idf:
             top_terms.append(pinned)
     # 更偏中文：先取中文，再穿插少量英文/缩写
-    zh_terms = [t for t in keyword_candidates if is_chinese_term(t)]
-    other_terms = [t for t in keyword_candidates if not is_chinese_term(t)]
+    # 每组最多消耗 TOP_TERMS_LIMIT 个新词 + 已置顶的重复词，只取这么多即可；
+    # keyword_idf 按 doc_freq 的顺序构建，nlargest 的并列次序与 most_common() 相同
+    group_limit = TOP_TERMS_LIMIT + len(top_terms)
+    zh_terms = heapq.nlargest(
+        group_limit,
+        (t for t in keyword_idf if is_chinese_term(t)),
+        key=doc_freq.__getitem__,
+    )
+    other_terms = heapq.nlargest(
+        group_limit,
+        (t for t in keyword_idf if not is_chinese_term(t)),
+        key=doc_freq.__getitem__,
+    )
     zh_idx = 0
     other_idx = 0
     seen_terms = set(top_terms)
-    while len(top_terms) < 40 and (zh_idx < len(zh_terms) or other_idx < len(other_terms)):
+    while len(top_terms) < TOP_TERMS_LIMIT and (
+        zh_idx < len(zh_terms) or other_idx < len(other_terms)
+    ):
         for _ in range(2):
-            if zh_idx < len(zh_terms) and len(top_terms) < 40:
+            if zh_idx < len(zh_terms) and len(top_terms) < TOP_TERMS_LIMIT:
                 term = zh_terms[zh_idx]
                 zh_idx += 1
                 if term in seen_terms:
                     continue
                 top_terms.append(term)
                 seen_terms.add(term)
-        if other_idx < len(other_terms) and len(top_terms) < 40:
+        if other_idx < len(other_terms) and len(top_terms) < TOP_TERMS_LIMIT:
             term = other_terms[other_idx]
             other_idx += 1
             if term in seen_terms:
@@ -1728,19 +2143,17 @@ def build_index(
     }
 
     generated_utc = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%SZ")
-    payload = {
-        "generated_utc": generated_utc,
-        "total": len(items),
-        "items": items,
-        "insights": insights,
-    }
-
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    write_index_json(out_path, generated_utc, items, insights)
 
     if search_index_dir is not None:
-        write_search_index(search_index_dir, search_entries, search_shard_size, generated_utc)
+        write_search_index(
+            search_index_dir,
+            search_entries,
+            search_shard_size,
+            generated_utc,
+            compress=search_gzip,
+        )
     if interaction_out:
         interaction_payload = build_interaction_report(
             items,
@@ -1749,12 +2162,13 @@ def build_index(
             quote_buckets,
             boundary_quotes,
             generated_utc,
+            item_dts=item_dts,
         )
         interaction_dir = os.path.dirname(interaction_out)
         if interaction_dir:
             os.makedirs(interaction_dir, exist_ok=True)
-        with open(interaction_out, "w", encoding="utf-8") as f:
-            json.dump(interaction_payload, f, ensure_ascii=False, indent=2)
+        with open(interaction_out, "wb") as f:
+            f.write(json_dumps_indented(interaction_payload))
 
 
 def main():
@@ -1796,6 +2210,12 @@ def main():
         default=300,
         help="Entries per search shard",
     )
+    parser.add_argument(
+        "--search-gzip",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Gzip search index shards (the app decompresses them in the browser)",
+    )
     parser.add_argument(
         "--include-search-text",
         action="store_true",
@@ -1812,6 +2232,17 @@ def main():
         default=240,
         help="Max characters for snippet",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for large datasets (1 disables multiprocessing)",
+    )
+    parser.add_argument(
+        "--vocab-cache-dir",
+        default=None,
+        help="Cache the bootstrapped Chinese vocabulary here to skip rebuilding on reruns",
+    )
     args = parser.parse_args()
 
     search_dir = args.search_index_dir or None
@@ -1827,6 +2258,9 @@ def main():
         search_shard_size=args.search_shard_size,
         include_search_text=args.include_search_text,
         interaction_out=interaction_out,
+        workers=args.workers,
+        vocab_cache_dir=args.vocab_cache_dir,
+        search_gzip=args.search_gzip,
     )
     print(f"Wrote {args.out}")
 
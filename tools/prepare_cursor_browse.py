@@ -6,7 +6,21 @@ import os
 import re
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
+from itertools import chain, count, islice
+from operator import itemgetter
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 SKIP_CONTENT_TYPES = {
@@ -16,6 +30,9 @@ SKIP_CONTENT_TYPES = {
     "user_editable_context",
 }
 
+# 缺省字段的只读占位，避免每条消息都新建空 dict（不要修改它）
+EMPTY_DICT = {}
+
 TOOL_JSON_KEYS = {
     "search_query",
     "response_length",
@@ -26,6 +43,65 @@ TOOL_JSON_KEYS = {
     "function",
     "call",
 }
+TOOL_JSON_KEY_MARKERS = tuple(f'"{key}"' for key in TOOL_JSON_KEYS)
+
+# 不超过该大小的 conversations.json 直接整体解析，比逐段 raw_decode 快得多
+JSON_ARRAY_SLURP_MAX_BYTES = 64 * 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+CONVERSATIONS_REL_PREFIX = os.path.join("conversations", "")
+PARALLEL_BATCH_SIZE = 1000
+PARALLEL_CHUNK_SIZE = 32
+SLUG_RE = re.compile(r"[^a-z0-9]+")
+SLUG_TABLE = str.maketrans(
+    {chr(code): "-" for code in range(128) if SLUG_RE.match(chr(code))}
+)
+ARRAY_SEPARATOR_RE = re.compile(r"[ \t\r\n,]*")
+# orjson 会把超出 64 位的整数静默转成浮点数；这类整数至少有 19 位连续数字
+WIDE_INT_RE = re.compile(r"[0-9]{19}")
+WIDE_INT_MARK = b"0" * 19
+DIGIT_MASK_TABLE = bytes(0x30 if 0x30 <= code <= 0x39 else 0x20 for code in range(256))
+ARRAY_VALUE_END = " \t\r\n,]"
+
+def has_wide_int(raw):
+    """粗查是否有 19 位以上的连续数字（也可能在字符串里，误判只会多走一次标准库）。"""
+    if isinstance(raw, str):
+        return WIDE_INT_RE.search(raw) is not None
+    # 字节串先把数字映射成 "0"、其余映射成空格，再用 find 查找，比正则快得多
+    return WIDE_INT_MARK in raw.translate(DIGIT_MASK_TABLE)
+
+
+if orjson is not None:
+    def json_loads(text):
+        if has_wide_int(text):
+            return json.loads(text)
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # orjson 更严格（NaN、超大整数、孤立代理等），退回标准库保持原有判定
+            return json.loads(text)
+
+    def json_dumps(value):
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # 超过 64 位的整数、非字符串键等 orjson 不支持的值交给标准库
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    def json_dumps_indented(value):
+        try:
+            return orjson.dumps(value, option=orjson.OPT_INDENT_2).decode("utf-8")
+        except orjson.JSONEncodeError:
+            return json.dumps(value, ensure_ascii=False, indent=2)
+
+else:
+    json_loads = json.loads
+
+    def json_dumps(value):
+        # 与 orjson 的紧凑输出保持一致，保证有无 orjson 生成的 markdown 相同
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    def json_dumps_indented(value):
+        return json.dumps(value, ensure_ascii=False, indent=2)
 
 
 def format_ts(ts):
@@ -41,7 +117,11 @@ def slugify(title):
     if not title:
         return "conv"
     text = title.lower()
-    text = re.sub(r"[^a-z0-9]+", "-", text).strip("-")
+    if text.isascii():
+        # ASCII 标题走 translate，避免正则引擎开销
+        text = "-".join(filter(None, text.translate(SLUG_TABLE).split("-")))
+    else:
+        text = SLUG_RE.sub("-", text).strip("-")
     return text or "conv"
 
 
@@ -51,18 +131,17 @@ def iter_conversations(path):
             ["jq", "-c", ".[]", path],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
         )
     except FileNotFoundError:
         proc = None
 
     if proc:
+        # jq 输出的是 UTF-8 的逐行 JSON，直接把字节交给解析器，省掉文本解码这一层
         for line in proc.stdout:
-            line = line.strip()
-            if not line:
+            if line.isspace():
                 continue
-            yield json.loads(line)
-        err = proc.stderr.read()
+            yield json_loads(line)
+        err = proc.stderr.read().decode("utf-8", "replace")
         rc = proc.wait()
         if rc != 0:
             raise RuntimeError(f"jq failed with code {rc}: {err.strip()}")
@@ -72,11 +151,51 @@ def iter_conversations(path):
         yield item
 
 
+def peek_json_start(path, size=4096):
+    with open(path, "rb") as f:
+        head = f.read(size).lstrip()
+    return head[:1]
+
+
 def iter_json_array(path, chunk_size=1024 * 1024):
+    streamed = 0
+    if orjson is not None and os.path.getsize(path) <= JSON_ARRAY_SLURP_MAX_BYTES:
+        with open(path, "rb") as f:
+            raw = f.read()
+        data = None
+        if not has_wide_int(raw):
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                pass
+        del raw
+        if isinstance(data, list):
+            yield from data
+            return
+        # 含超宽整数、解析失败或顶层不是数组（截断、带 BOM 等）时按逐段方式容错读取
+    elif ijson is not None and peek_json_start(path) == b"[":
+        # 大文件交给 ijson（优先 yajl2_c 后端）逐条流式解析，内存占用恒定
+        try:
+            with open(path, "rb") as f:
+                for item in ijson.items(f, "item", use_float=True):
+                    streamed += 1
+                    yield item
+        except ijson.JSONError:
+            # 超宽整数、NaN/Infinity 或文件被截断时 ijson 会报错，改用逐段读取补齐剩余条目
+            pass
+        else:
+            return
+    yield from islice(iter_json_array_chunks(path, chunk_size), streamed, None)
+
+
+def iter_json_array_chunks(path, chunk_size=1024 * 1024):
+    """逐段读取并用 raw_decode 解析 JSON 数组，容忍截断的文件。"""
     decoder = json.JSONDecoder()
     buf = ""
     started = False
     idx = 0
+    # 对象跨块解析失败后，等缓冲区里未解析的部分翻倍再重试，避免大对象被反复从头解析
+    retry_at = 0
     with open(path, "r", encoding="utf-8") as f:
         while True:
             chunk = f.read(chunk_size)
@@ -90,10 +209,11 @@ def iter_json_array(path, chunk_size=1024 * 1024):
                     continue
                 idx = start + 1
                 started = True
+            if len(buf) < retry_at:
+                continue
 
             while True:
-                while idx < len(buf) and buf[idx] in " \t\r\n,":
-                    idx += 1
+                idx = ARRAY_SEPARATOR_RE.match(buf, idx).end()
                 if idx >= len(buf):
                     break
                 if buf[idx] == "]":
@@ -101,17 +221,23 @@ def iter_json_array(path, chunk_size=1024 * 1024):
                 try:
                     obj, end = decoder.raw_decode(buf, idx)
                 except json.JSONDecodeError:
+                    retry_at = 2 * len(buf) - idx
+                    break
+                if end == len(buf) or buf[end] not in ARRAY_VALUE_END:
+                    # 数字可能被块边界截断（如 "12.5" 只读到 "12."），确认后面是分隔符再产出
                     break
                 yield obj
                 idx = end
-            buf = buf[idx:]
+            # 已消费的部分过半时才搬移缓冲区，避免每读一块都复制整段剩余文本
+            if idx * 2 > len(buf):
+                buf = buf[idx:]
+                retry_at -= idx
+                idx = 0
 
     if not started:
         return
-    idx = 0
     while True:
-        while idx < len(buf) and buf[idx] in " \t\r\n,":
-            idx += 1
+        idx = ARRAY_SEPARATOR_RE.match(buf, idx).end()
         if idx >= len(buf) or buf[idx] == "]":
             break
         try:
@@ -126,16 +252,20 @@ def pick_path(mapping, current_node):
     if current_node in mapping:
         node_id = current_node
     else:
-        leaves = [k for k, v in mapping.items() if not v.get("children")]
-        if not leaves:
+        # 一次遍历找出最新的叶子节点；与 max 一样，时间相同时取先出现的
+        node_id = None
+        best_time = None
+        for key, node in mapping.items():
+            if node.get("children"):
+                continue
+            msg = node.get("message") or {}
+            created = msg.get("create_time") or 0
+            if node_id is None or created > best_time:
+                node_id = key
+                best_time = created
+        if node_id is None:
             return []
 
-        def score(node_key):
-            msg = mapping.get(node_key, {}).get("message") or {}
-            return msg.get("create_time") or 0
-
-        node_id = max(leaves, key=score)
-
     path = []
     seen = set()
     while node_id and node_id not in seen:
@@ -165,7 +295,7 @@ def render_content(content, keep_metadata=False):
                 if part.strip():
                     rendered.append(part)
             else:
-                rendered.append(json.dumps(part, ensure_ascii=False))
+                rendered.append(json_dumps(part))
         return "\n".join(rendered)
 
     if ctype == "code":
@@ -173,8 +303,7 @@ def render_content(content, keep_metadata=False):
         if not text.strip():
             return ""
         lang = (content.get("language") or "").strip()
-        fence = "```" + (lang if lang else "")
-        return f"{fence}\n{text}\n```"
+        return f"```{lang}\n{text}\n```"
 
     if ctype == "execution_output":
         return content.get("text") or ""
@@ -200,13 +329,13 @@ def render_content(content, keep_metadata=False):
                     dims = f" ({w}x{h})" if w and h else ""
                     rendered.append(f"[image]{dims} {pointer}")
                 else:
-                    rendered.append(json.dumps(part, ensure_ascii=False))
+                    rendered.append(json_dumps(part))
                 continue
             rendered.append(str(part))
         return "\n".join([item for item in rendered if item])
 
     if keep_metadata:
-        return json.dumps(content, ensure_ascii=False, indent=2)
+        return json_dumps_indented(content)
 
     return ""
 
@@ -215,16 +344,18 @@ def render_message(node, keep_hidden=False, keep_system=False, keep_metadata=Fal
     msg = node.get("message")
     if not msg:
         return None
-    meta = msg.get("metadata") or {}
-    if meta.get("is_visually_hidden_from_conversation") and not keep_hidden:
-        return None
+    get = msg.get
+    if not keep_hidden:
+        meta = get("metadata")
+        if meta and meta.get("is_visually_hidden_from_conversation"):
+            return None
 
-    author = msg.get("author") or {}
+    author = get("author") or EMPTY_DICT
     role = author.get("role") or "unknown"
     if role == "system" and not keep_system:
         return None
 
-    content = msg.get("content") or {}
+    content = get("content") or EMPTY_DICT
     body = render_content(content, keep_metadata=keep_metadata)
     if not body.strip():
         return None
@@ -233,14 +364,15 @@ def render_message(node, keep_hidden=False, keep_system=False, keep_metadata=Fal
 
     name = author.get("name")
     role_label = role if not name else f"{role}:{name}"
-    ts = msg.get("create_time")
-    time_label = format_ts(ts)
+    time_label = format_ts(get("create_time"))
     if time_label != "unknown":
         role_label = f"{role_label} ({time_label})"
     return role_label, body
 
 
 def is_tool_call_block(text):
+    if not text or not isinstance(text, str):
+        return False
     stripped = text.strip()
     if not stripped:
         return False
@@ -262,13 +394,148 @@ def is_tool_call_block(text):
         payload = "\n".join(lines[1:-1]).strip()
         if not payload:
             return False
+    # 只有 {...} 才可能解析成 dict；普通正文在这里直接返回，省掉一次注定失败的解析
+    if not (payload.startswith("{") and payload.endswith("}")):
+        return False
+    # 键名可能带转义（如 "\u0070ath"），含反斜杠时不能靠子串预筛
+    if "\\" not in payload and not any(marker in payload for marker in TOOL_JSON_KEY_MARKERS):
+        return False
     try:
-        obj = json.loads(payload)
+        obj = json_loads(payload)
     except json.JSONDecodeError:
         return False
     if not isinstance(obj, dict):
         return False
-    return any(key in obj for key in TOOL_JSON_KEYS)
+    return not TOOL_JSON_KEYS.isdisjoint(obj)
+
+
+def write_index_md(path, rows):
+    now = format_ts(datetime.now(tz=timezone.utc).timestamp())
+    md_lines = ["| {} | {} | {} | {} | {} | {} |".format(*row[:6]) for row in rows]
+    md_lines.append("")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(
+            "# Conversations Index\n\n"
+            f"Generated: {now}\n\n"
+            "| # | Title | Created (UTC) | Updated (UTC) | Messages | File |\n"
+            "|---|---|---|---|---|---|\n" + "\n".join(md_lines)
+        )
+
+
+def write_conversation(
+    total,
+    conv,
+    conv_dir,
+    keep_hidden=False,
+    keep_system=False,
+    keep_metadata=False,
+    include_all_nodes=False,
+):
+    title = conv.get("title") or "Untitled"
+    conv_id = conv.get("id") or conv.get("conversation_id") or ""
+    create_time = format_ts(conv.get("create_time"))
+    update_time = format_ts(conv.get("update_time"))
+
+    mapping = conv.get("mapping") or {}
+    messages = []
+    if include_all_nodes:
+        collected = []
+        for node_id, node in mapping.items():
+            msg = node.get("message")
+            if not msg:
+                continue
+            rendered = render_message(
+                node,
+                keep_hidden=keep_hidden,
+                keep_system=keep_system,
+                keep_metadata=keep_metadata,
+            )
+            if rendered:
+                created = msg.get("create_time") or 0
+                collected.append((created, node_id, rendered))
+        # 按 (时间, 节点 id) 排序；itemgetter 在 C 里取键，不必每个元素调用一次 lambda
+        collected.sort(key=itemgetter(0, 1))
+        messages = [entry[2] for entry in collected]
+    else:
+        path = pick_path(mapping, conv.get("current_node"))
+        for node in path:
+            rendered = render_message(
+                node,
+                keep_hidden=keep_hidden,
+                keep_system=keep_system,
+                keep_metadata=keep_metadata,
+            )
+            if rendered:
+                messages.append(rendered)
+
+    date_prefix = "unknown"
+    if conv.get("create_time"):
+        try:
+            dt = datetime.fromtimestamp(conv["create_time"], tz=timezone.utc)
+            date_prefix = dt.strftime("%Y%m%d")
+        except Exception:
+            date_prefix = "unknown"
+
+    slug = slugify(title)
+    suffix = conv_id.split("-")[-1][:8] if conv_id else f"{total:04d}"
+    filename = f"{total:04d}_{date_prefix}_{slug}_{suffix}.md"
+    # 分隔符已知，直接拼接，免去每条对话两次 os.path.join
+    rel_path = CONVERSATIONS_REL_PREFIX + filename
+    out_path = f"{conv_dir}{os.sep}{filename}"
+
+    parts = [f"# {title}\n\n"]
+    if conv_id:
+        parts.append(f"- id: {conv_id}\n")
+    if conv.get("conversation_id"):
+        parts.append(f"- conversation_id: {conv.get('conversation_id')}\n")
+    parts.append(
+        f"- created_utc: {create_time}\n"
+        f"- updated_utc: {update_time}\n"
+        f"- messages: {len(messages)}\n"
+        "\n---\n\n"
+    )
+    for role_label, body in messages:
+        parts += (
+            f"<!-- MSG role: {role_label} -->\n### {role_label}\n\n",
+            body,
+            "\n\n<!-- /MSG -->\n\n",
+        )
+    # 整篇拼好后一次写出，省掉每条消息多次 write 的编码与调用开销
+    # newline="" 跳过换行转换，各平台都输出 \n，与 generic 路径按字节写出的文件一致
+    with open(
+        out_path, "w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE
+    ) as f:
+        f.write("".join(parts))
+
+    return [total, title, create_time, update_time, len(messages), rel_path, conv_id]
+
+
+def iter_batched_map(func, *iterables, workers=1, initializer=None, initargs=()):
+    """与 map(func, *iterables) 相同、按输入顺序产出结果；数据够一个批次且 workers > 1 时
+    分批交给进程池（func 须可 pickle）。串行时 initializer 在当前进程执行一次。"""
+    args = zip(*iterables)
+    batch = list(islice(args, PARALLEL_BATCH_SIZE))
+    # 小数据集不足一个批次时进程池的启动开销得不偿失，直接串行
+    if workers <= 1 or len(batch) < PARALLEL_BATCH_SIZE:
+        if initializer is not None:
+            initializer(*initargs)
+        for item_args in chain(batch, args):
+            yield func(*item_args)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=initializer, initargs=initargs
+    ) as pool:
+        while batch:
+            # 分批提交，避免把整个输入一次性读进内存；map 按输入顺序返回，输出与串行一致
+            yield from pool.map(func, *zip(*batch), chunksize=PARALLEL_CHUNK_SIZE)
+            batch = list(islice(args, PARALLEL_BATCH_SIZE))
+
+
+def iter_written_conversations(conversations, conv_dir, workers=1, **options):
+    # 编号在父进程按输入顺序分配（count(1) 与对话逐条配对）
+    task = partial(write_conversation, conv_dir=conv_dir, **options)
+    return iter_batched_map(task, count(1), conversations, workers=workers)
 
 
 def build_conversation_files(
@@ -278,6 +545,8 @@ def build_conversation_files(
     keep_system=False,
     keep_metadata=False,
     include_all_nodes=False,
+    emit_index_md=True,
+    workers=1,
 ):
     conv_dir = os.path.join(out_dir, "conversations")
     os.makedirs(conv_dir, exist_ok=True)
@@ -285,100 +554,34 @@ def build_conversation_files(
     index_md_path = os.path.join(out_dir, "index.md")
     index_csv_path = os.path.join(out_dir, "index.csv")
 
-    total = 0
-    with open(index_md_path, "w", encoding="utf-8") as index_md, open(
-        index_csv_path, "w", encoding="utf-8", newline=""
+    rows = list(
+        iter_written_conversations(
+            iter_conversations(input_path),
+            conv_dir,
+            workers=workers,
+            keep_hidden=keep_hidden,
+            keep_system=keep_system,
+            keep_metadata=keep_metadata,
+            include_all_nodes=include_all_nodes,
+        )
+    )
+    # 行已全部在内存里，整批写出，避免逐行经过 TextIOWrapper
+    with open(
+        index_csv_path,
+        "w",
+        encoding="utf-8",
+        newline="",
+        buffering=WRITE_BUFFER_SIZE,
     ) as index_csv:
         writer = csv.writer(index_csv)
         writer.writerow(
             ["index", "title", "created_utc", "updated_utc", "messages", "file", "id"]
         )
+        writer.writerows(rows)
 
-        index_md.write("# Conversations Index\n\n")
-        index_md.write(f"Generated: {format_ts(datetime.now(tz=timezone.utc).timestamp())}\n\n")
-        index_md.write(
-            "| # | Title | Created (UTC) | Updated (UTC) | Messages | File |\n"
-        )
-        index_md.write("|---|---|---|---|---|---|\n")
-
-        for conv in iter_conversations(input_path):
-            total += 1
-            title = conv.get("title") or "Untitled"
-            conv_id = conv.get("id") or conv.get("conversation_id") or ""
-            create_time = format_ts(conv.get("create_time"))
-            update_time = format_ts(conv.get("update_time"))
-
-            mapping = conv.get("mapping") or {}
-            messages = []
-            if include_all_nodes:
-                collected = []
-                for node_id, node in mapping.items():
-                    msg = node.get("message")
-                    if not msg:
-                        continue
-                    rendered = render_message(
-                        node,
-                        keep_hidden=keep_hidden,
-                        keep_system=keep_system,
-                        keep_metadata=keep_metadata,
-                    )
-                    if rendered:
-                        created = msg.get("create_time") or 0
-                        collected.append((created, node_id, rendered))
-                collected.sort(key=lambda item: (item[0], item[1]))
-                messages = [entry[2] for entry in collected]
-            else:
-                path = pick_path(mapping, conv.get("current_node"))
-                for node in path:
-                    rendered = render_message(
-                        node,
-                        keep_hidden=keep_hidden,
-                        keep_system=keep_system,
-                        keep_metadata=keep_metadata,
-                    )
-                    if rendered:
-                        messages.append(rendered)
-
-            date_prefix = "unknown"
-            if conv.get("create_time"):
-                try:
-                    dt = datetime.fromtimestamp(
-                        conv["create_time"], tz=timezone.utc
-                    )
-                    date_prefix = dt.strftime("%Y%m%d")
-                except Exception:
-                    date_prefix = "unknown"
-
-            slug = slugify(title)
-            suffix = conv_id.split("-")[-1][:8] if conv_id else f"{total:04d}"
-            filename = f"{total:04d}_{date_prefix}_{slug}_{suffix}.md"
-            rel_path = os.path.join("conversations", filename)
-            out_path = os.path.join(conv_dir, filename)
-
-            with open(out_path, "w", encoding="utf-8") as f:
-                f.write(f"# {title}\n\n")
-                if conv_id:
-                    f.write(f"- id: {conv_id}\n")
-                if conv.get("conversation_id"):
-                    f.write(f"- conversation_id: {conv.get('conversation_id')}\n")
-                f.write(f"- created_utc: {create_time}\n")
-                f.write(f"- updated_utc: {update_time}\n")
-                f.write(f"- messages: {len(messages)}\n")
-                f.write("\n---\n\n")
-                for role_label, body in messages:
-                    f.write(f"<!-- MSG role: {role_label} -->\n")
-                    f.write(f"### {role_label}\n\n")
-                    f.write(f"{body}\n\n")
-                    f.write("<!-- /MSG -->\n\n")
-
-            index_md.write(
-                f"| {total} | {title} | {create_time} | {update_time} | {len(messages)} | {rel_path} |\n"
-            )
-            writer.writerow(
-                [total, title, create_time, update_time, len(messages), rel_path, conv_id]
-            )
-
-    return total
+    if emit_index_md:
+        write_index_md(index_md_path, rows)
+    return len(rows)
 
 
 def main():
@@ -415,6 +618,12 @@ def main():
         action="store_true",
         help="Include all nodes in the conversation tree (not just the current path)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for large exports (1 disables multiprocessing)",
+    )
     args = parser.parse_args()
 
     total = build_conversation_files(
@@ -424,6 +633,7 @@ def main():
         keep_system=args.keep_system,
         keep_metadata=args.keep_metadata,
         include_all_nodes=args.include_all_nodes,
+        workers=args.workers,
     )
     print(f"Processed {total} conversations into {args.out_dir}")
 
@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""加速改写与原实现的等价性测试。
+
+运行：python -m unittest discover -s tools（或 python -m pytest tools）
+"""
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import build_data as bd  # noqa: E402
+import build_insights_index as bii  # noqa: E402
+import prepare_cursor_browse as pcb  # noqa: E402
+
+
+# 改写前 parse_messages 使用的正则
+OLD_MSG_BLOCK_RE = re.compile(
+    r"<!-- MSG role: (.+?) -->\n(?:### .+?\n\n)?([\s\S]*?)\n<!-- /MSG -->",
+    re.MULTILINE,
+)
+MSG_PIECES = [
+    "<!-- MSG role: ",
+    " -->",
+    "\n",
+    "\n\n",
+    "### ",
+    "\n<!-- /MSG -->",
+    "<!-- /MSG -->",
+    "user",
+    "assistant",
+    "-",
+    " ",
+    "x",
+    "中文",
+]
+
+
+def old_normalize_term(term):
+    """改写前的 normalize_term（逐项查别名、停用词和噪声词）。"""
+    if not term:
+        return None
+    t = term.strip()
+    if not t:
+        return None
+    lower = t.lower()
+    mapped = bii.TERM_ALIASES.get(lower) or bii.TERM_ALIASES.get(t) or t
+    mapped_lower = mapped.lower()
+    if bii.is_noise_term(mapped):
+        return None
+    if mapped_lower in bii.EN_STOPWORDS or mapped_lower in bii.NOISE_TERMS:
+        return None
+    if mapped in bii.ZH_STOPWORDS:
+        return None
+    if mapped_lower.startswith("http"):
+        return None
+    if mapped_lower.isdigit():
+        return None
+    if not any("\u4e00" <= ch <= "\u9fff" for ch in mapped):
+        if len(mapped_lower) <= 2 and mapped_lower not in bii.SHORT_ALLOW:
+            return None
+        if any(ch.isdigit() for ch in mapped_lower) and len(mapped_lower) <= 3:
+            return None
+    return mapped
+
+
+def old_push_quote(bucket, quote, limit=60):
+    """改写前的 push_quote：溢出时整表排序再截断。"""
+    bucket.append(quote)
+    if len(bucket) <= limit:
+        return
+    bucket.sort(key=bii.quote_sort_key)
+    del bucket[limit:]
+
+
+def old_iter_json_array(path):
+    """改写前的逐段读取器；一次读入整个文件，作为截断/容错行为的参照。"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read()
+    start = buf.find("[")
+    if start == -1:
+        return
+    idx = start + 1
+    while True:
+        while idx < len(buf) and buf[idx] in " \t\r\n,":
+            idx += 1
+        if idx >= len(buf) or buf[idx] == "]":
+            break
+        try:
+            obj, end = decoder.raw_decode(buf, idx)
+        except json.JSONDecodeError:
+            break
+        yield obj
+        idx = end
+
+
+def old_iter_generic_conversations(path):
+    """改写前的通用导出读取：整份 json.load。"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "conversations" in data:
+        data = data["conversations"]
+    if not isinstance(data, list):
+        raise ValueError("Generic export must be a list of conversations.")
+    yield from data
+
+
+def old_iter_jsonl(path):
+    """改写前的 JSONL 读取：文本模式逐行 strip 后 json.loads。"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line)
+
+
+def old_format_ts(value):
+    """改写前 build_data 的 format_ts（ISO_TS_RE 按修正后的模式）。"""
+    if not value:
+        return "unknown"
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc).strftime(
+                "%Y-%m-%d %H:%M:%SZ"
+            )
+        except Exception:
+            return "unknown"
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return "unknown"
+        if text.endswith("Z") and "T" in text:
+            return text.replace("T", " ").replace("+00:00", "Z")
+        if re.match(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}Z", text):
+            return text
+    return "unknown"
+
+
+def old_pick_export(root_dir, source):
+    """改写前目录输入的选择规则：os.walk 全树收集，取最大的文件（同大小取路径最小）。"""
+    candidates = []
+    for root, _, files in os.walk(root_dir):
+        for name in files:
+            if source == "chatgpt":
+                matched = name in {"conversations.json", "conversations.jsonl"}
+            else:
+                matched = name.lower().endswith((".json", ".jsonl"))
+            if matched:
+                candidates.append(os.path.join(root, name))
+    if not candidates:
+        return None
+    return sorted(candidates, key=lambda p: (-os.path.getsize(p), p))[0]
+
+
+def write_temp(tmp, name, text):
+    path = os.path.join(tmp, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def dump(values):
+    # NaN != NaN，统一序列化后再比较
+    return json.dumps(values, allow_nan=True)
+
+
+class IterMsgBlocksTest(unittest.TestCase):
+    def assert_same(self, body, pos=0):
+        expected = [m.groups() for m in OLD_MSG_BLOCK_RE.finditer(body, pos)]
+        self.assertEqual(list(bii.iter_msg_blocks(body, pos)), expected, repr(body))
+
+    def test_examples(self):
+        cases = [
+            "",
+            "no markers here",
+            "<!-- MSG role: user -->\nhello\n<!-- /MSG -->",
+            "<!-- MSG role: user -->\n### User\n\nhello\n<!-- /MSG -->",
+            # 标题后没有空行：标题算正文
+            "<!-- MSG role: user -->\n### User\nhello\n<!-- /MSG -->",
+            # 空 role、跨行 role、缺结束标记
+            "<!-- MSG role:  -->\nx\n<!-- /MSG -->",
+            "<!-- MSG role: us\ner -->\nx\n<!-- /MSG -->",
+            "<!-- MSG role: user -->\nunterminated",
+            # 空正文与相邻块
+            "<!-- MSG role: a -->\n\n<!-- /MSG -->"
+            "<!-- MSG role: b -->\n### B\n\n\n<!-- /MSG -->",
+            # 正文里出现开始标记
+            "<!-- MSG role: a -->\n<!-- MSG role: b -->\nx\n<!-- /MSG -->",
+        ]
+        for body in cases:
+            self.assert_same(body)
+
+    def test_random_bodies(self):
+        rng = random.Random(7)
+        for _ in range(20000):
+            body = "".join(rng.choice(MSG_PIECES) for _ in range(rng.randint(0, 24)))
+            self.assert_same(body, rng.randint(0, 3) if body else 0)
+
+
+class WriteIndexJsonTest(unittest.TestCase):
+    PAYLOADS = [
+        ("2026-01-01 00:00:00Z", [], {}),
+        ("2026-01-01 00:00:00Z", [], {"clusters": [], "hot_terms": {}}),
+        (
+            "2026-01-01 00:00:00Z",
+            [
+                {"title": "多行\n标题", "tags": [], "meta": {}},
+                {"title": 'quote " and \\ slash', "nested": {"a": [1, [2, {"b": None}]]}},
+                {"score": 1.5, "flag": True, "empty": ""},
+            ],
+            {"trends": [{"month": "2026-01", "count": 3}], "note": "line\nbreak"},
+        ),
+    ]
+
+    def assert_same(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.json")
+            for generated_utc, items, insights in self.PAYLOADS:
+                bii.write_index_json(path, generated_utc, items, insights)
+                with open(path, "rb") as f:
+                    written = f.read()
+                payload = {
+                    "generated_utc": generated_utc,
+                    "total": len(items),
+                    "items": items,
+                    "insights": insights,
+                }
+                self.assertEqual(written, bii.json_dumps_indented(payload))
+
+    def test_current_backend(self):
+        self.assert_same()
+
+    def test_stdlib_backend(self):
+        def dumps_indented(value):
+            return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+
+        with mock.patch.object(bii, "json_dumps_indented", dumps_indented):
+            self.assert_same()
+
+
+class PushQuoteTest(unittest.TestCase):
+    def test_matches_sort_then_truncate(self):
+        rng = random.Random(11)
+        for _ in range(2000):
+            limit = rng.randint(1, 8)
+            old_bucket = []
+            new_bucket = []
+            for serial in range(rng.randint(0, 40)):
+                # 分数和文本取值很少，制造大量并列；serial 用来区分插入顺序
+                quote = {
+                    "score": rng.randint(0, 3),
+                    "text": rng.choice("abc"),
+                    "serial": serial,
+                }
+                if rng.random() < 0.1:
+                    del quote["score"]
+                old_push_quote(old_bucket, quote, limit)
+                bii.push_quote(new_bucket, quote, limit)
+            # 旧实现只在溢出时排序，报告里再排一次；稳定排序保证并列按插入顺序
+            old_bucket.sort(key=bii.quote_sort_key)
+            self.assertEqual(new_bucket, old_bucket[:limit])
+
+
+class TermTableTest(unittest.TestCase):
+    def test_normalize_term_matches_old(self):
+        terms = set(bii.TERM_TABLE)
+        terms.update(bii.TERM_ALIASES.values())
+        terms.update(
+            [
+                "", " ", "ai", "AI", "ml", "go", "x1", "a1b", "v12", "2026", "http://x",
+                "HTTPS", "python", "Python3", "中文", "的", "  数据  ", "it's", "gpt",
+            ]
+        )
+        variants = set()
+        for term in terms:
+            variants.update((term, term.upper(), term.title(), f" {term} "))
+        for term in sorted(variants):
+            self.assertEqual(bii.normalize_term(term), old_normalize_term(term), repr(term))
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    SAMPLES = [
+        "[]",
+        "  [ ]  ",
+        "[1, 2, 3]",
+        "[12.5, -0.25, 1e5, 1E-3, 100, 0]",
+        '[{"a": [1, {"b": "]"}]}, [], {}, [[[]]], "x, y", null, true, false]',
+        '\n[\n  {"title": "中文 \\" 转义", "n": 123456789},\n  {"nested": {"deep": [1.0, 2]}}\n]\n',
+        # 截断文件：最后一个对象/数字不完整
+        '[{"a": 1}, {"b": 2}, {"c": ',
+        "[1, 2, 345",
+        "[1, 2, 3.",
+        '[{"a": 1}',
+        # 顶层不是数组、完全没有 "["
+        '{"conversations": [1, 2]}',
+        '"just a string"',
+        "",
+    ]
+
+    # 超宽整数、NaN/Infinity、溢出的浮点数，以及在这些值之后被截断的文件
+    ODD_NUMBER_SAMPLES = [
+        '[{"n": 123456789012345678901234567890}, {"m": -9223372036854775809}, 1]',
+        '[18446744073709551616, 1.5]',
+        '[{"a": 1}, {"x": NaN}, {"y": Infinity}, -Infinity, 2]',
+        '[1e400, {"b": 2}]',
+        '[{"a": 1}, {"n": 123456789012345678901234567890}, {"x": NaN}, {"t": "tr',
+        '[{"a": 1}, {"b": 2}, 12345678901234567890123',
+    ]
+
+    def read(self, text, chunk_size, backends=False, use_ijson=False):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_temp(tmp, "data.json", text)
+            if backends:
+                return list(pcb.iter_json_array(path, chunk_size=chunk_size))
+            if use_ijson:
+                # 屏蔽 orjson，模拟大文件走 ijson 的路径
+                with mock.patch.object(pcb, "orjson", None):
+                    return list(pcb.iter_json_array(path, chunk_size=chunk_size))
+            # 屏蔽 orjson / ijson，强制走逐段读取的路径
+            with mock.patch.object(pcb, "orjson", None), mock.patch.object(pcb, "ijson", None):
+                return list(pcb.iter_json_array(path, chunk_size=chunk_size))
+
+    def expected(self, text):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            return list(old_iter_json_array(path))
+
+    def test_small_chunks_match_reference(self):
+        for text in self.SAMPLES:
+            expected = self.expected(text)
+            for chunk_size in range(1, 6):
+                self.assertEqual(self.read(text, chunk_size), expected, (text, chunk_size))
+
+    def test_valid_arrays_match_json_load(self):
+        rng = random.Random(3)
+        for _ in range(200):
+            data = [
+                rng.choice(
+                    [
+                        rng.randint(-10**6, 10**6),
+                        round(rng.uniform(-1000, 1000), rng.randint(0, 6)),
+                        "s" * rng.randint(0, 5) + ",]",
+                        {"k": [rng.randint(0, 9) for _ in range(rng.randint(0, 3))]},
+                        [],
+                        None,
+                    ]
+                )
+                for _ in range(rng.randint(0, 12))
+            ]
+            text = json.dumps(data, ensure_ascii=False, indent=rng.choice([None, 1]))
+            self.assertEqual(self.read(text, rng.randint(1, 7)), json.loads(text))
+
+    def test_every_truncation_point(self):
+        text = '[{"id": 1, "t": "a]b"}, 12.75, [3, 4], "end", 9001]'
+        for cut in range(len(text) + 1):
+            prefix = text[:cut]
+            expected = self.expected(prefix)
+            for chunk_size in (1, 2, 5):
+                self.assertEqual(self.read(prefix, chunk_size), expected, (prefix, chunk_size))
+
+    def test_accelerated_backends(self):
+        # orjson 整块解析失败（截断）时应退回逐段读取，结果不变
+        for text in self.SAMPLES:
+            if not text.lstrip().startswith("["):
+                continue
+            self.assertEqual(self.read(text, 3, backends=True), self.expected(text), text)
+
+    @unittest.skipIf(pcb.ijson is None, "ijson is not installed")
+    def test_ijson_falls_back_to_chunks(self):
+        # ijson 遇到截断或它不支持的数字时，应由逐段读取补齐，结果与原读取器一致
+        for text in self.SAMPLES + self.ODD_NUMBER_SAMPLES:
+            if not text.lstrip().startswith("["):
+                continue
+            actual = dump(self.read(text, 4, use_ijson=True))
+            self.assertEqual(actual, dump(self.expected(text)), text)
+
+    def test_odd_numbers_match_reference(self):
+        for text in self.ODD_NUMBER_SAMPLES:
+            expected = dump(self.expected(text))
+            self.assertEqual(dump(self.read(text, 3, backends=True)), expected, text)
+            for chunk_size in range(1, 6):
+                self.assertEqual(dump(self.read(text, chunk_size)), expected, (text, chunk_size))
+
+
+class GenericConversationsTest(unittest.TestCase):
+    SAMPLES = [
+        "[]",
+        '[{"title": "a"}, {"title": "b", "messages": []}]',
+        # 超出 64 位的整数、NaN/Infinity、溢出的浮点数：标准库能读，ijson 不能
+        '[{"title": "a", "n": 123456789012345678901234567890}, {"title": "b"}]',
+        '[{"title": "a"}, {"title": "b", "x": NaN, "y": -Infinity}]',
+        '[{"title": "a", "n": 1e400}]',
+        '{"conversations": [{"title": "a"}, {"n": 123456789012345678901234567890}]}',
+        '{"conversations": [{"title": "a", "x": Infinity}]}',
+        '{"conversations": []}',
+        '{"meta": {"n": 1}, "conversations": [{"title": "a"}]}',
+    ]
+
+    def assert_same(self, path):
+        self.assertEqual(
+            dump(list(bd.iter_generic_conversations(path))),
+            dump(list(old_iter_generic_conversations(path))),
+        )
+
+    def test_matches_json_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for text in self.SAMPLES:
+                path = write_temp(tmp, "export.json", text)
+                self.assert_same(path)
+                with mock.patch.object(bd, "ijson", None):
+                    self.assert_same(path)
+
+    def test_not_a_list(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for text in ('{"items": []}', '"x"'):
+                path = write_temp(tmp, "export.json", text)
+                with self.assertRaises(ValueError):
+                    list(bd.iter_generic_conversations(path))
+
+
+class JsonLoadsTest(unittest.TestCase):
+    SAMPLES = [
+        '{"a": 1, "b": [1.5, -2, "x"]}',
+        "123456789012345678901234567890",
+        '[18446744073709551616, -9223372036854775809, 18446744073709551615]',
+        '{"id": "1234567890123456789012", "n": 1}',
+        '{"x": NaN, "y": Infinity, "z": -Infinity}',
+        "[1e400]",
+        '{"s": "\\u4e2d\\u6587"}',
+    ]
+
+    def test_matches_stdlib(self):
+        for text in self.SAMPLES:
+            expected = dump(json.loads(text))
+            self.assertEqual(dump(pcb.json_loads(text)), expected, text)
+            self.assertEqual(dump(pcb.json_loads(text.encode("utf-8"))), expected, text)
+            # 整数类型也要一致：超宽整数不能被悄悄转成浮点数
+            self.assertEqual(
+                repr(pcb.json_loads(text.encode("utf-8"))), repr(json.loads(text)), text
+            )
+
+
+class IterJsonlTest(unittest.TestCase):
+    SAMPLES = [
+        "",
+        "\n\n",
+        '{"a": 1}\n{"b": 2}\n',
+        '{"a": 1}\n\n   \n\t\n{"b": 2}',
+        '{"a": 1}\r\n{"b": 2}\r\n',
+        '  {"padded": true}  \n',
+        '{"n": 123456789012345678901234567890}\n{"x": NaN}\n{"y": -Infinity}\n',
+        '{"t": "中文"}\n[1, 2]\n3\n',
+    ]
+
+    def assert_same(self, text):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_temp(tmp, "export.jsonl", text)
+            self.assertEqual(
+                repr(list(bd.iter_jsonl(path))), repr(list(old_iter_jsonl(path))), text[:80]
+            )
+            self.assertEqual(
+                repr(list(bd.iter_generic_conversations(path))),
+                repr(list(old_iter_jsonl(path))),
+            )
+
+    def test_samples(self):
+        for text in self.SAMPLES:
+            self.assert_same(text)
+
+    def test_very_long_lines(self):
+        # 单行远大于读缓冲区，且前后夹着普通行
+        long_record = json.dumps({"title": "big", "body": "x" * (8 * 1024 * 1024 + 7)})
+        self.assert_same(f'{{"a": 1}}\n{long_record}\n\n{{"b": 2}}')
+        self.assert_same(long_record)
+
+
+class FormatTsTest(unittest.TestCase):
+    def test_matches_reference(self):
+        values = [
+            None, 0, "", "  ", [], {}, True,
+            1700000000, 1700000000.5, 1700000000.9999996, -1.5, 1e20, float("nan"),
+            "2026-01-02T03:04:05Z", "2026-01-02T03:04:05+00:00Z", "  2026-01-02T03:04:05Z ",
+            "2026-01-02 03:04:05Z", "2026-01-02 03:04:05Zjunk", "2026/01/02", "yesterday",
+        ]
+        for value in values:
+            self.assertEqual(bd.format_ts(value), old_format_ts(value), repr(value))
+
+    def test_space_separated_utc_is_kept(self):
+        # 改写前的正则被双重转义，从未匹配过；该格式现在原样保留
+        self.assertEqual(bd.format_ts("2026-01-02 03:04:05Z"), "2026-01-02 03:04:05Z")
+
+
+class ResolveInputPathTest(unittest.TestCase):
+    FILES = {
+        "conversations.json": 10,
+        "a/conversations.json": 40,
+        "a/b/conversations.jsonl": 40,
+        "c/conversations.json": 25,
+        "c/other.json": 500,
+        "d/e/f/notes.JSONL": 80,
+        "d/readme.txt": 900,
+    }
+
+    def make_tree(self, tmp, files):
+        for rel, size in files.items():
+            path = os.path.join(tmp, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(b" " * size)
+
+    def assert_same(self, files):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.make_tree(tmp, files)
+            for source in ("chatgpt", "generic"):
+                expected = old_pick_export(tmp, source)
+                if expected is None:
+                    with self.assertRaises(FileNotFoundError):
+                        bd.resolve_input_path(tmp, source)
+                    continue
+                self.assertEqual(bd.resolve_input_path(tmp, source), expected, source)
+
+    def test_largest_anywhere_with_ties(self):
+        self.assert_same(self.FILES)
+
+    def test_shallow_file_is_not_preferred(self):
+        self.assert_same({"conversations.json": 5, "x/y/z/conversations.json": 50})
+
+    def test_no_candidates(self):
+        self.assert_same({"readme.txt": 3})
+
+    def test_random_trees(self):
+        rng = random.Random(5)
+        names = ["conversations.json", "conversations.jsonl", "data.json", "x.JSON", "y.txt"]
+        for _ in range(30):
+            files = {}
+            for _ in range(rng.randint(1, 8)):
+                depth = rng.randint(0, 3)
+                rel = os.path.join(*(rng.choice("pq") for _ in range(depth)), rng.choice(names))
+                files[rel] = rng.choice([1, 2, 3, 7])
+            self.assert_same(files)
+
+
+if __name__ == "__main__":
+    unittest.main()